@@ -18,122 +18,51 @@ add_negatives.py — Week2: 负样本采集（label=0）
   - 合并进同一个 data/daily/YYYY-MM-DD.json
   - 不覆盖正样本
   - 自动重算 count/meta/category_stats
+  - 每次运行结束都把合并结果（含 data/daily/YYYY-MM-DD.jsonl journal）原子写回 json 并删除 journal
 """
 
 from __future__ import annotations
 
 import argparse
-import json
-import os
 import random
-import time
-from datetime import date
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
 
+import orjson
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
+from common.daily import (
+    VIDEO_URL_PREFIX,
+    add_video,
+    load_daily,
+    recompute_daily_stats,
+    save_daily,
+    today_str,
+    utc_ts,
+)
+from common.http import RateLimiter, paced_get, request_session
 
-NEWLIST_API = "https://api.bilibili.com/x/web-interface/newlist"
 
-DATA_DIR = "data"
-DAILY_DIR = os.path.join(DATA_DIR, "daily")
+NEWLIST_API = "https://api.bilibili.com/x/web-interface/newlist"
 
 PS = 50
 
-HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36"
-    ),
-    "Accept": "application/json, text/plain, */*",
-    "Referer": "https://www.bilibili.com/",
-}
-
-
-def utc_ts() -> int:
-    return int(time.time())
-
-
-def today_str() -> str:
-    return date.today().isoformat()
-
-
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
-
-
-def read_json(path: str) -> Any:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def atomic_write_json(path: str, obj: Any) -> None:
-    ensure_dir(os.path.dirname(path))
-    tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, path)
-
-
-def request_session() -> requests.Session:
-    s = requests.Session()
-    s.headers.update(HEADERS)
-    retry = Retry(
-        total=3,
-        backoff_factor=0.8,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"],
-        raise_on_status=False,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    s.mount("https://", adapter)
-    s.mount("http://", adapter)
-    return s
+# 并发拉取 newlist 的线程数；限速由 RateLimiter 统一控制
+MAX_WORKERS = 8
+# 基础请求间隔（秒）：服务器正常时不额外等待；session 以 paced 模式创建，429/412 不被 urllib3 内部重试吞掉，
+# 直接反馈给 RateLimiter 自适应放慢，再由 paced_get 在放慢后的间隔下重试
+REQUEST_INTERVAL = 0.0
 
 
-def recompute_daily_stats(daily: Dict[str, Any]) -> None:
-    videos = daily.get("videos", [])
-    daily["count"] = len(videos)
-
-    pos = sum(1 for v in videos if int(v.get("label", 0)) == 1)
-    neg = sum(1 for v in videos if int(v.get("label", 0)) == 0)
-    daily["meta"] = {"pos_count": pos, "neg_count": neg, "total_count": len(videos)}
-
-    cat: Dict[str, Any] = {}
-    for v in videos:
-        tid = v.get("tid")
-        if tid is None:
-            continue
-        tid_s = str(tid)
-        tname = v.get("tname") or ""
-        if tid_s not in cat:
-            cat[tid_s] = {"tname": tname, "video_count": 0}
-        if not cat[tid_s]["tname"] and tname:
-            cat[tid_s]["tname"] = tname
-        cat[tid_s]["video_count"] += 1
-    daily["category_stats"] = cat
-
-
-def index_by_bvid(videos: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-    out: Dict[str, Dict[str, Any]] = {}
-    for v in videos:
-        bvid = v.get("bvid")
-        if bvid:
-            out[str(bvid)] = v
-    return out
-
-
-def count_pos_by_tid(videos: List[Dict[str, Any]]) -> Dict[int, int]:
+def count_pos_by_tid(videos: Iterable[Dict[str, Any]]) -> Dict[int, int]:
     out: Dict[int, int] = {}
     for v in videos:
-        if int(v.get("label", 0)) != 1:
+        if v.get("label") != 1:
             continue
         tid = v.get("tid")
         if tid is None:
             continue
-        out[int(tid)] = out.get(int(tid), 0) + 1
+        out[tid] = out.get(tid, 0) + 1
     return out
 
 
@@ -153,28 +82,30 @@ def parse_newlist_items(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
 
 
 def build_negative_record(item: Dict[str, Any], capture_ts: int) -> Optional[Dict[str, Any]]:
-    bvid = item.get("bvid")
+    get = item.get
+    bvid = get("bvid")
     if not bvid:
         return None
+    bvid = str(bvid)
 
-    aid = item.get("aid") or item.get("id") or 0
-    tid = item.get("tid")
-    tname = item.get("tname") or ""
-    pubdate = item.get("pubdate") or item.get("ctime") or 0
+    aid = get("aid") or get("id") or 0
+    tid = get("tid")
+    tname = get("tname") or ""
+    pubdate = get("pubdate") or get("ctime") or 0
 
-    owner = item.get("owner") or {}
+    owner = get("owner") or {}
     up = {
-        "mid": owner.get("mid") or item.get("mid") or 0,
-        "name": owner.get("name") or item.get("author") or "",
+        "mid": owner.get("mid") or get("mid") or 0,
+        "name": owner.get("name") or get("author") or "",
         "follower": None,
     }
 
     return {
-        "bvid": str(bvid),
+        "bvid": bvid,
         "aid": int(aid) if aid is not None else 0,
         "label": 0,
-        "title": item.get("title") or "",
-        "url": f"https://www.bilibili.com/video/{bvid}",
+        "title": get("title") or "",
+        "url": VIDEO_URL_PREFIX + bvid,
         "tid": int(tid) if tid is not None else None,
         "tname": tname,
         "pubdate": int(pubdate) if pubdate else 0,
@@ -185,11 +116,56 @@ def build_negative_record(item: Dict[str, Any], capture_ts: int) -> Optional[Dic
     }
 
 
+def reservoir_sample(iterable: Iterable[Any], k: int, rng: Any = random) -> List[Any]:
+    """
+    单次遍历等概率采样 k 条（Algorithm R），不需要先物化完整候选列表
+    不足 k 条时全取
+    """
+    picked: List[Any] = []
+    if k <= 0:
+        return picked
+    for i, it in enumerate(iterable):
+        if i < k:
+            picked.append(it)
+            continue
+        j = rng.randrange(i + 1)
+        if j < k:
+            picked[j] = it
+    return picked
+
+
+def fetch_newlist(
+    s: requests.Session, limiter: RateLimiter, tid: int, ps: int
+) -> Optional[List[Dict[str, Any]]]:
+    """拉取单个 tid 的 newlist；失败 / 404 / code!=0 返回 None（在线程池中执行）"""
+    params = {"rid": tid, "pn": 1, "ps": ps}
+    try:
+        r = paced_get(s, limiter, NEWLIST_API, params=params, timeout=20)
+    except requests.RequestException:
+        return None
+
+    if r.status_code == 404:
+        # 跳过 404 / 不支持分区
+        return None
+
+    try:
+        payload = orjson.loads(r.content)
+    except Exception:
+        return None
+
+    if payload.get("code") != 0:
+        return None
+
+    return parse_newlist_items(payload)
+
+
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("day", nargs="?", default=today_str(), help="YYYY-MM-DD (default: today)")
     ap.add_argument("--ps", type=int, default=PS, help="newlist page size (default: 50)")
     ap.add_argument("--seed", type=int, default=None, help="random seed (optional)")
+    # 每次运行都会折叠 journal；保留该参数只为兼容已有的定时任务命令行
+    ap.add_argument("--compact", action="store_true", help="no-op: every run folds the day journal into the json")
     args = ap.parse_args()
 
     if args.seed is not None:
@@ -198,86 +174,57 @@ def main() -> None:
     day = args.day
     capture_ts = utc_ts()
 
-    daily_path = os.path.join(DAILY_DIR, f"{day}.json")
-    if not os.path.exists(daily_path):
-        raise FileNotFoundError(f"daily file not found: {daily_path}")
+    daily, index = load_daily(day)
 
-    daily = read_json(daily_path)
-    videos: List[Dict[str, Any]] = daily.get("videos", [])
-    bvid_map = index_by_bvid(videos)
-
-    pos_by_tid = count_pos_by_tid(videos)
+    pos_by_tid = count_pos_by_tid(daily["videos"])
     if not pos_by_tid:
         print("[add_negatives] no positive samples found; nothing to do.")
         return
 
-    s = request_session()
+    limiter = RateLimiter(REQUEST_INTERVAL)
     added = 0
 
-    for tid, need in sorted(pos_by_tid.items(), key=lambda x: x[0]):
-        if need <= 0:
-            continue
-
-        params = {"rid": tid, "pn": 1, "ps": int(args.ps)}
-        try:
-            r = s.get(NEWLIST_API, params=params, timeout=20)
-        except requests.RequestException:
-            continue
-
-        if r.status_code == 404:
-            # 跳过 404 / 不支持分区
-            continue
-
-        try:
-            payload = r.json()
-        except Exception:
-            continue
-
-        if payload.get("code") != 0:
-            continue
-
-        items = parse_newlist_items(payload)
-        if not items:
-            continue
+    tids = [tid for tid in sorted(pos_by_tid) if pos_by_tid[tid] > 0]
+    ps = int(args.ps)
 
-        # 过滤掉已存在 bvid（含热门正样本）
-        candidates: List[Dict[str, Any]] = []
-        for it in items:
-            bv = it.get("bvid")
-            if not bv:
-                continue
-            if str(bv) in bvid_map:
-                continue
-            candidates.append(it)
-
-        if not candidates:
-            continue
+    # 已存在 bvid 的成员集合（含热门正样本）；过滤循环只查这个 set，新增负样本时同步加入
+    existing_bvids = set(index)
 
-        # 随机采样 need 条（不足则全取）
-        k = min(need, len(candidates))
-        picked = random.sample(candidates, k=k)
+    # session 用完即关闭，释放连接池
+    with request_session(paced=True) as s, ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        results = pool.map(lambda tid: fetch_newlist(s, limiter, tid, ps), tids)
 
-        for it in picked:
-            rec = build_negative_record(it, capture_ts)
-            if not rec:
+        # 采样/合并在主线程按 tid 顺序执行：daily 单线程修改，--seed 结果可复现
+        for tid, items in zip(tids, results):
+            if not items:
                 continue
-            bv = rec["bvid"]
-            if bv in bvid_map:
-                continue
-            bvid_map[bv] = rec
-            added += 1
-
-        # 简单限速（避免被限流）
-        time.sleep(0.2)
+            need = pos_by_tid[tid]
+
+            # 过滤掉已存在 bvid（接口返回的 bvid 本身就是 str，无需再 str()），
+            # 随机采样 need 条（不足则全取）
+            candidates = (it for it in items if (bv := it.get("bvid")) and bv not in existing_bvids)
+            picked = reservoir_sample(candidates, k=need, rng=random)
+
+            for it in picked:
+                rec = build_negative_record(it, capture_ts)
+                if not rec:
+                    continue
+                bv = rec["bvid"]
+                if bv in existing_bvids:
+                    continue
+                add_video(daily, index, rec)
+                existing_bvids.add(bv)
+                added += 1
 
     daily["capture_ts"] = capture_ts
-    daily["videos"] = list(bvid_map.values())
     recompute_daily_stats(daily)
 
-    atomic_write_json(daily_path, daily)
+    # 整份原子写回 json（journal 已回放进来），再删除 journal
+    out_path = save_daily(day, daily)
+
     print(f"[add_negatives] day={day} added={added} total={daily['count']}")
-    print(f"[add_negatives] wrote: {daily_path}")
+    print(f"[add_negatives] wrote: {out_path}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
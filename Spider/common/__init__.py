@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Spider 脚本共用的工具：
+- io：json/字节的原子写入与读取
+- http：requests session 与限速器
+- daily：data/daily/YYYY-MM-DD.json(+.jsonl) 的加载、合并、统计
+"""
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+data/daily/YYYY-MM-DD.json 的公共逻辑：加载（含 journal 回放）、按 bvid 合并、重算统计
+
+daily["videos"] 在内存中与落盘时都是 list（原样保留没有 bvid / bvid 重复的记录，不会因加载而丢数据）；
+按 bvid 查找用 index_videos 另建的 {bvid: record} 索引，索引与 list 共享同一批记录
+
+journal（YYYY-MM-DD.jsonl）只是一次运行内的增量/checkpoint：每次运行结束都由 save_daily 折叠回 json。
+每行带递增的 seq，json 里记录已折叠到的 journal_seq；回放时跳过 seq <= journal_seq 的行，
+所以 json 写完、journal 删除前崩溃，下次加载也不会用旧行盖掉新记录（折叠是幂等的）
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+
+from .io import append_bytes, atomic_write_json, ensure_dir, fsync_dir, read_json
+
+
+DATA_DIR = "data"
+DAILY_DIR = os.path.join(DATA_DIR, "daily")
+
+VIDEO_URL_PREFIX = "https://www.bilibili.com/video/"
+
+
+def utc_ts() -> int:
+    return int(time.time())
+
+
+def today_str() -> str:
+    return date.today().isoformat()
+
+
+def like_rate(like: Optional[int], view: Optional[int]) -> Optional[float]:
+    # 入参已是 int（解析时转换过），int / int 直接得到 float；保留 6 位与已有数据一致
+    if like is None or not view or view < 0:
+        return None
+    return round(like / view, 6)
+
+
+def build_daily_skeleton(day: str, capture_ts: int) -> Dict[str, Any]:
+    return {
+        "date": day,
+        "capture_ts": capture_ts,
+        "source": "bilibili_popular",
+        "count": 0,
+        "category_stats": {},
+        "meta": {"pos_count": 0, "neg_count": 0, "total_count": 0},
+        "journal_seq": 0,
+        "videos": [],
+    }
+
+
+def recompute_daily_stats(daily: Dict[str, Any]) -> None:
+    """单次遍历同时统计 pos/neg 与 category_stats"""
+    videos = daily.get("videos", [])
+
+    pos = 0
+    neg = 0
+    cat: Dict[str, Any] = {}
+    for v in videos:
+        label = v.get("label", 0)
+        if label == 1:
+            pos += 1
+        elif label == 0:
+            neg += 1
+
+        tid = v.get("tid")
+        if tid is None:
+            continue
+        # tid 种类很少（几十个分区）：intern 后同一 tid 共用一个 str，dict 比较可走指针相等
+        tid_s = sys.intern(str(tid))
+        tname = v.get("tname") or ""
+        entry = cat.get(tid_s)
+        if entry is None:
+            entry = cat[tid_s] = {"tname": sys.intern(tname), "video_count": 0}
+        elif not entry["tname"] and tname:
+            entry["tname"] = sys.intern(tname)
+        entry["video_count"] += 1
+
+    daily["count"] = len(videos)
+    daily["meta"] = {"pos_count": pos, "neg_count": neg, "total_count": len(videos)}
+    daily["category_stats"] = cat
+
+
+def merge_video(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """
+    README 合并规则（原地更新 old，即 existing_map 中已存的记录）：
+    - snapshots/features：取并集（不覆盖已有）
+    - tid/tname/stat/url/title/pubdate/up：用非空新值补旧值
+    - label：只要有一次是 1 → 永远 1
+    """
+    # label: max
+    old["label"] = 1 if (old.get("label") == 1 or new.get("label") == 1) else 0
+
+    # prefer earliest first_seen_ts
+    fst_old = old.get("first_seen_ts")
+    fst_new = new.get("first_seen_ts")
+    if fst_old is None:
+        old["first_seen_ts"] = fst_new
+    elif fst_new is not None:
+        old["first_seen_ts"] = min(int(fst_old), int(fst_new))
+
+    # scalar fields: fill if old empty (None / "" / 0)
+    for k in ("aid", "title", "url", "tid", "tname", "pubdate"):
+        nv = new.get(k)
+        if nv and not old.get(k):
+            old[k] = nv
+
+    # up object: fill missing subfields
+    up = old.get("up") or {}
+    new_up = new.get("up") or {}
+    for k in ("mid", "name", "follower"):
+        nv = new_up.get(k)
+        if nv and not up.get(k):
+            up[k] = nv
+    old["up"] = up
+
+    # snapshots/features: union, do not overwrite existing keys
+    snap = old.get("snapshots") or {}
+    for dk, dv in (new.get("snapshots") or {}).items():
+        snap.setdefault(dk, dv)
+    old["snapshots"] = snap
+
+    feat = old.get("features") or {}
+    for dk, dv in (new.get("features") or {}).items():
+        feat.setdefault(dk, dv)
+    old["features"] = feat
+
+
+def index_videos(videos: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    加载后单次遍历：label/tid 规范为 int（下游热路径不再逐处 int(...)），同时按 bvid 建索引
+    只建索引、不过滤 list：没有 bvid 的记录不进索引；bvid 重复时索引指向第一条，其余仍留在 list 里
+    bvid 去掉首尾空白后作为索引 key
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for v in videos:
+        v["label"] = int(v.get("label", 0) or 0)
+        tid = v.get("tid")
+        if tid is not None:
+            v["tid"] = int(tid)
+        bvid = str(v.get("bvid") or "").strip()
+        if bvid:
+            out.setdefault(bvid, v)
+    return out
+
+
+def add_video(daily: Dict[str, Any], index: Dict[str, Dict[str, Any]], rec: Dict[str, Any]) -> None:
+    """新记录同时追加到 list 和索引"""
+    daily["videos"].append(rec)
+    index[str(rec["bvid"]).strip()] = rec
+
+
+def journal_path(day: str) -> str:
+    return os.path.join(DAILY_DIR, f"{day}.jsonl")
+
+
+def append_journal(path: str, rows: Iterable[Dict[str, Any]], daily: Dict[str, Any]) -> None:
+    """
+    O_APPEND 追加 JSONL（每行一条 op），写完 fsync
+    行格式：{"op": "put", "video": {...}} 为合并后的完整记录；{"op": "stats", ...} 为本次运行后的汇总
+    每行盖上 seq = daily["journal_seq"] + 1, + 2, ...，并同步更新 daily["journal_seq"]
+    """
+    seq = int(daily.get("journal_seq") or 0)
+    parts: List[bytes] = []
+    for row in rows:
+        seq += 1
+        row["seq"] = seq
+        parts.append(orjson.dumps(row, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+    append_bytes(path, b"".join(parts))
+    daily["journal_seq"] = seq
+
+
+def replay_journal(daily: Dict[str, Any], path: str, index: Dict[str, Dict[str, Any]]) -> None:
+    """
+    把 journal 回放到 daily（daily["videos"] 为 list，index 为其 bvid 索引）
+    put 整条原地替换（写入时已是合并结果）：带 "i"（写入时在 list 中的下标）且该位置 bvid 一致时替换该条，
+    否则替换索引指向的那条，索引里没有就追加；stats 行覆盖顶层汇总字段
+    末尾半行（写入中途崩溃）直接跳过；seq <= json 里 journal_seq 的行已折叠过，跳过
+    （没有 seq 的旧格式行照常回放）
+    """
+    folded = int(daily.get("journal_seq") or 0)
+    daily["journal_seq"] = folded
+    if not os.path.exists(path):
+        return
+    videos = daily["videos"]
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                row = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            seq = row.get("seq")
+            if isinstance(seq, int):
+                if seq <= folded:
+                    continue
+                daily["journal_seq"] = max(daily["journal_seq"], seq)
+            op = row.get("op")
+            if op == "put":
+                v = row.get("video") or {}
+                bvid = str(v.get("bvid") or "").strip()
+                if not bvid:
+                    continue
+                i = row.get("i")
+                if isinstance(i, int) and 0 <= i < len(videos) and str(videos[i].get("bvid") or "").strip() == bvid:
+                    cur: Optional[Dict[str, Any]] = videos[i]
+                else:
+                    cur = index.get(bvid)
+                if cur is None:
+                    add_video(daily, index, v)
+                else:
+                    # 原地替换：list 位置与索引引用都不变
+                    cur.clear()
+                    cur.update(v)
+            elif op == "stats":
+                for k in ("capture_ts", "count", "meta", "category_stats"):
+                    if k in row:
+                        daily[k] = row[k]
+
+
+def stats_row(daily: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "op": "stats",
+        "capture_ts": daily.get("capture_ts"),
+        "count": daily.get("count"),
+        "meta": daily.get("meta"),
+        "category_stats": daily.get("category_stats"),
+    }
+
+
+def remove_journal(path: str) -> None:
+    """整份 json 已落盘后调用：journal 内容已折叠进 json（只是清理，正确性靠 journal_seq）"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    fsync_dir(os.path.dirname(path))
+
+
+def save_daily(day: str, daily: Dict[str, Any], fsync: bool = True) -> str:
+    """
+    运行结束时调用：把完整 daily（已回放 journal）原子写回 json，再删除 journal
+    json 带着 journal_seq 落盘，删除 journal 之前崩溃时下次回放会跳过这些行；返回 json 路径
+    """
+    daily_path = os.path.join(DAILY_DIR, f"{day}.json")
+    daily.setdefault("journal_seq", 0)
+    atomic_write_json(daily_path, daily, fsync=fsync)
+    remove_journal(journal_path(day))
+    return daily_path
+
+
+def load_or_init_daily(day: str, capture_ts: int) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """返回 (daily, bvid 索引)；当天 json 不存在时从空骨架开始"""
+    ensure_dir(DAILY_DIR)
+    daily_path = os.path.join(DAILY_DIR, f"{day}.json")
+    if os.path.exists(daily_path):
+        daily = read_json(daily_path)
+        # keep existing structure
+        daily["date"] = day
+        daily["videos"] = daily.get("videos") or []
+    else:
+        daily = build_daily_skeleton(day, capture_ts)
+    index = index_videos(daily["videos"])
+    replay_journal(daily, journal_path(day), index)
+    # update capture_ts to latest run（journal 中的 stats 行不覆盖本次时间）
+    daily["capture_ts"] = capture_ts
+    return daily, index
+
+
+def load_daily(day: str) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """读取已存在的当天 daily 并回放 journal，返回 (daily, bvid 索引)；文件不存在抛 FileNotFoundError"""
+    daily_path = os.path.join(DAILY_DIR, f"{day}.json")
+    if not os.path.exists(daily_path):
+        raise FileNotFoundError(f"daily file not found: {daily_path}")
+    daily = read_json(daily_path)
+    daily["videos"] = daily.get("videos") or []
+    index = index_videos(daily["videos"])
+    replay_journal(daily, journal_path(day), index)
+    return daily, index
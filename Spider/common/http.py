@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""HTTP：带重试的 requests session，以及线程共享的自适应限速器"""
+
+from __future__ import annotations
+
+import socket
+import threading
+import time
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+
+
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36"
+    ),
+    "Accept": "application/json, text/plain, */*",
+    "Referer": "https://www.bilibili.com/",
+}
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    池中每个 socket 在 urllib3 默认选项（TCP_NODELAY）之上再开 SO_KEEPALIVE：
+    长时间复用的空闲连接被中间设备静默断开时能尽早发现，而不是等到下次请求读超时
+    """
+
+    socket_options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def request_session(pool_maxsize: int = 32, paced: bool = False) -> requests.Session:
+    """
+    paced=True：该 session 的请求由 RateLimiter 控速（配合 paced_get），
+    429 不再由 urllib3 内部重试/睡眠，直接返回给调用方，限速器才能拿到限流信号
+    """
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    retry = Retry(
+        total=3,
+        backoff_factor=0.8,
+        # 并发请求同时失败时错开重试时间，避免一起打到限流
+        backoff_jitter=0.3,
+        status_forcelist=[500, 502, 503, 504] if paced else [429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    # 只访问 api.bilibili.com 一个 host；连接池按并发上限放大，避免默认 maxsize=10 限住线程池
+    adapter = KeepAliveAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize, pool_block=False)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+# 被限流的状态码：429 为标准限流，412 为 B 站风控拦截
+THROTTLE_STATUS = (412, 429)
+# paced_get 遇到限流状态码时的最多重试次数（每次先经过已放慢的 RateLimiter）
+THROTTLE_RETRIES = 3
+
+
+class RateLimiter:
+    """
+    线程安全的自适应请求间隔：多个线程共享同一速率
+    - 正常时按 base_interval（可为 0）放行
+    - 收到 429 / 412（B 站风控拦截）：间隔翻倍（至少 0.2s，至多 max_interval），并遵守 Retry-After
+    - 响应头 X-RateLimit-Remaining 降到 0：同样放慢，有 Retry-After 时等到该时间
+    - 每 decay_every 次成功响应后间隔 ×0.9，逐步回落到 base_interval
+    """
+
+    def __init__(self, base_interval: float = 0.0, max_interval: float = 5.0, decay_every: int = 10) -> None:
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.decay_every = decay_every
+        self.interval = base_interval
+        self._lock = threading.Lock()
+        self._next_ts = 0.0
+        self._ok_streak = 0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_ts - now
+            self._next_ts = max(now, self._next_ts) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def feedback(self, status_code: int, headers: Any = None) -> None:
+        """请求返回后调用，根据状态码 / 限流响应头调整间隔"""
+        remaining = parse_ratelimit_remaining(headers)
+        exhausted = remaining is not None and remaining <= 0
+        with self._lock:
+            if status_code in THROTTLE_STATUS or exhausted:
+                self._ok_streak = 0
+                self.interval = min(max(self.interval * 2, 0.2), self.max_interval)
+                retry_after = parse_retry_after(headers)
+                if retry_after:
+                    self._next_ts = max(self._next_ts, time.monotonic() + retry_after)
+                return
+            if status_code >= 400:
+                return
+            self._ok_streak += 1
+            if self._ok_streak >= self.decay_every:
+                self._ok_streak = 0
+                self.interval = max(self.base_interval, self.interval * 0.9)
+
+
+def paced_get(
+    s: requests.Session, limiter: RateLimiter, url: str, retries: int = THROTTLE_RETRIES, **kwargs: Any
+) -> requests.Response:
+    """
+    经 RateLimiter 放行后发 GET，并把状态码/响应头反馈给限速器
+    被限流（429/412）时在放慢后的间隔下重试，最多 retries 次，返回最后一次响应；网络异常照常抛出
+    """
+    while True:
+        limiter.wait()
+        r = s.get(url, **kwargs)
+        limiter.feedback(r.status_code, r.headers)
+        if r.status_code not in THROTTLE_STATUS or retries <= 0:
+            return r
+        retries -= 1
+
+
+def parse_retry_after(headers: Any) -> Optional[float]:
+    """只解析秒数形式的 Retry-After；HTTP-date 形式忽略"""
+    if not headers:
+        return None
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_ratelimit_remaining(headers: Any) -> Optional[int]:
+    """X-RateLimit-Remaining：本窗口剩余请求数；没有该头 / 无法解析返回 None"""
+    if not headers:
+        return None
+    value = headers.get("X-RateLimit-Remaining")
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
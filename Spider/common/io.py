@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""文件读写：tmp + fsync + rename 的原子写入，orjson 读写"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from typing import Any
+
+import orjson
+
+
+def ensure_dir(path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+
+
+def read_json(path: str) -> Any:
+    """mmap 整个文件交给 orjson 解析，不先 read() 复制一份 bytes；空文件 mmap 不了，走普通路径（解析报错）"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as mv:
+            return orjson.loads(mv)
+
+
+def fsync_dir(path: str) -> None:
+    """fsync 目录本身，让其中的 rename/新建文件落盘"""
+    dfd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def atomic_write_json(path: str, obj: Any, durable: bool = True, fsync: bool = True) -> None:
+    """
+    tmp 写入 + fsync(file) + rename，避免崩溃后留下 0 字节文件
+    durable=False：跳过父目录 fsync（批量写入时由调用方最后统一 fsync_dir 一次）
+    fsync=False：文件和目录都不 fsync，只保留 rename 的原子性（可丢的中间文件用）
+    """
+    ensure_dir(os.path.dirname(path))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if durable and fsync:
+        fsync_dir(os.path.dirname(path))
+
+
+def atomic_write_bytes(path: str, data: bytes, durable: bool = True) -> None:
+    """原样写入字节（raw 响应不再 decode + re-encode），语义同 atomic_write_json"""
+    ensure_dir(os.path.dirname(path))
+    tmp = path + ".tmp"
+    fd = os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    try:
+        _write_all(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+    if durable:
+        fsync_dir(os.path.dirname(path))
+
+
+def append_bytes(path: str, data: bytes) -> None:
+    """O_APPEND 追加写入并 fsync（JSONL journal 用）"""
+    ensure_dir(os.path.dirname(path))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        _write_all(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -26,7 +26,6 @@
 
 from __future__ import annotations
 
-import json
 import os
 import time
 from typing import Any, Dict, List, Optional
@@ -39,6 +38,7 @@ from Pos_sample import (
     DAILY_DIR,
     RAW_DIR,
     SLEEP_BETWEEN_PAGES,
+    atomic_write_json,
     build_session,
     datetime_compact,
     dedup_by_bvid,
@@ -252,8 +252,7 @@ def main() -> None:
                 raw_path = os.path.join(
                     RAW_REGION_DIR, f"{datetime_compact(ts)}_rid{rid}_pn{pn}_ps{PS}.json"
                 )
-                with open(raw_path, "w", encoding="utf-8") as f:
-                    json.dump(raw, f, ensure_ascii=False, indent=2)
+                atomic_write_json(raw_path, raw, durable=False)
 
                 data = raw.get("data") or {}
                 archives = data.get("archives") or []
@@ -262,13 +261,6 @@ def main() -> None:
                     print(f"[INFO] rid={rid} pn={pn} empty (or -404), stop this rid.")
                     break
 
-                # 备份 raw
-                raw_path = os.path.join(
-                    RAW_REGION_DIR, f"{datetime_compact(ts)}_rid{rid}_pn{pn}_ps{PS}.json"
-                )
-                with open(raw_path, "w", encoding="utf-8") as f:
-                    json.dump(raw, f, ensure_ascii=False, indent=2)
-
                 all_archives.extend(archives)
                 rid_collected += len(archives)
                 time.sleep(SLEEP_BETWEEN_PAGES)
@@ -285,8 +277,7 @@ def main() -> None:
     daily = merge_daily_pos(daily, new_neg)
     daily = recompute_daily_fields(daily)
 
-    with open(daily_path, "w", encoding="utf-8") as f:
-        json.dump(daily, f, ensure_ascii=False, indent=2)
+    atomic_write_json(daily_path, daily)
 
     print(
         f"[OK] date={date} rids={len(RID_LIST)} archives={len(all_archives)} "
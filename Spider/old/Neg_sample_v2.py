@@ -3,10 +3,15 @@
 Week2 Step2 (Negative candidates) - dynamic/region
 
 改造目标（与 Step1 同步）：
-- 每页 raw 原始响应单独保存（不覆盖）
+- 每页 raw 原始响应单独保存（不覆盖，gzip 压缩为 .json.gz）
 - 每次运行生成一个 processed run JSON（不与历史合并、不覆盖）
-- 额外维护一个聚合总文件：按 bvid 聚合，在每个视频下面用 captures[<timestamp>] 存每次抓取的快照/特征
+- 额外维护聚合：按 bvid 聚合，在每个视频下面用 captures[<timestamp>] 存每次抓取的快照/特征
+  - agg/region_captures.ndjson：每次抓取追加一行（append-only，不再整份重写）
+  - agg/region_index.json：只存每个 bvid 的元信息 + captures_count
+  - load_aggregate_history() 可还原成旧版 region_history.json 的嵌套结构
 - 每条视频 record 增加 capture_ts
+- 每页记录 ETag/Last-Modified（agg/region_http_cache.json），下次带条件头请求，304 时复用上次 raw；
+  本次 run 照常保存该页 raw（复制上次的 .json.gz），每次 run 的 raw 目录仍是完整的
 
 API:
   https://api.bilibili.com/x/web-interface/dynamic/region
@@ -20,12 +25,16 @@ API:
 
 from __future__ import annotations
 
-import json
+import gzip
 import os
 import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -39,6 +48,8 @@ UA = (
     "Chrome/138.0.0.0 Safari/537.36"
 )
 
+URL_PREFIX = "https://www.bilibili.com/video/"
+
 DATA_DIR = "data"
 
 # ✅ 目录语义修正：
@@ -48,33 +59,50 @@ RAW_DIR = os.path.join(DATA_DIR, "raw", "Neg")
 RUN_DIR = os.path.join(DATA_DIR, "daily", "Neg")
 
 AGG_DIR = os.path.join(DATA_DIR, "agg")
-AGG_PATH = os.path.join(AGG_DIR, "region_history.json")
+AGG_PATH = os.path.join(AGG_DIR, "region_history.json")  # 旧版整份聚合文件（仅用于一次性迁移）
+AGG_CAPTURES_PATH = os.path.join(AGG_DIR, "region_captures.ndjson")
+AGG_INDEX_PATH = os.path.join(AGG_DIR, "region_index.json")
+
+# captures NDJSON 里 snapshots/features 按列存成数组（不重复写 key），读取时按列名 zip 还原
+SNAP_COLUMNS: List[str] = ["ts", "view", "like", "coin", "favorite", "reply", "danmaku", "share"]
+FEAT_COLUMNS: List[str] = ["like_rate", "coin_rate", "favorite_rate", "view_per_hour", "age_hours"]
+
+# 条件请求缓存：{"<rid>:<pn>": {"etag", "last_modified", "raw_path"}}，命中 304 时直接读上次保存的 raw
+HTTP_CACHE_PATH = os.path.join(AGG_DIR, "region_http_cache.json")
 
 TIMEOUT = 15
 SLEEP_BETWEEN_PAGES = 0.2
 
-# 默认抓一些主分区（可自行加 tid/rid）
-RID_LIST: List[int] = [
-    1,    # 动画
-    13,   # 番剧
-    167,  # 国创
-    3,    # 音乐
-    129,  # 舞蹈
-    4,    # 游戏
-    36,   # 知识
-    188,  # 科技
-    160,  # 生活
-    211,  # 美食
-    217,  # 动物圈
-    119,  # 鬼畜
-    155,  # 时尚
-    202,  # 资讯
-    5,    # 娱乐
-    181,  # 影视
-    177,  # 纪录片
-    23,   # 电影
-    11,   # 电视剧
-]
+# raw 页面 gzip 压缩级别：6 在体积与 CPU 间折中（9 慢很多，体积只小一点）
+RAW_GZIP_LEVEL = 6
+
+# 按 rid 并发抓取的线程数（每个 rid 内部仍按 pn 顺序翻页并 sleep）
+MAX_WORKERS = 8
+# raw 落盘的后台线程数：写盘与下一次 HTTP 请求重叠
+IO_WORKERS = 2
+# 默认抓一些主分区（可自行加 tid/rid）；rid → 主分区名（仅作说明，视频的 tid 多为其下子分区，不能用它查 tname）
+RID_TNAME: Dict[int, str] = {
+    1:   "动画",
+    13:  "番剧",
+    167: "国创",
+    3:   "音乐",
+    129: "舞蹈",
+    4:   "游戏",
+    36:  "知识",
+    188: "科技",
+    160: "生活",
+    211: "美食",
+    217: "动物圈",
+    119: "鬼畜",
+    155: "时尚",
+    202: "资讯",
+    5:   "娱乐",
+    181: "影视",
+    177: "纪录片",
+    23:  "电影",
+    11:  "电视剧",
+}
+RID_LIST: List[int] = list(RID_TNAME)
 
 PN_MAX = 10
 PS = 50
@@ -83,6 +111,12 @@ PS = 50
 OBS_HOURS = 48
 
 
+# orjson 选项（C 里直接写 UTF-8，不需要 ensure_ascii；int key 由 OPT_NON_STR_KEYS 转成字符串）
+_OPT_COMPACT = orjson.OPT_NON_STR_KEYS
+_OPT_PRETTY = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+_OPT_NDJSON = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+
+
 # ================== 工具函数 ==================
 def ensure_dirs() -> None:
     os.makedirs(RAW_DIR, exist_ok=True)
@@ -104,20 +138,50 @@ def datetime_compact_from_float(ts: float) -> str:
     ms = int((ts - int(ts)) * 1000)
     return f"{base}.{ms:03d}"
 
-def safe_div(a: Optional[float], b: Optional[float]) -> Optional[float]:
-    if a is None or b in (None, 0):
-        return None
-    return a / b
+def coalesce(a: Any, b: Any) -> Any:
+    """a 不为 None 时取 a，否则取 b"""
+    return a if a is not None else b
 
 def load_json_if_exists(path: str) -> Optional[Dict[str, Any]]:
     if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     return None
 
-def save_json(path: str, obj: Dict[str, Any]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+def save_json(path: str, obj: Dict[str, Any], compact: bool = False) -> None:
+    """
+    orjson 直接序列化成 bytes，一次 write
+    compact=True：不缩进（raw 页面只给程序读，体积约减半）；run/agg 保持缩进便于人看
+    """
+    write_bytes(path, dumps_json(obj, compact=compact))
+
+def dumps_json(obj: Any, compact: bool = False) -> bytes:
+    return orjson.dumps(obj, option=_OPT_COMPACT if compact else _OPT_PRETTY)
+
+def write_bytes(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+def write_gzip_bytes(path: str, data: bytes) -> None:
+    """压缩放在 IO 线程里做（zlib 压缩时释放 GIL，不挡抓取线程）"""
+    write_bytes(path, gzip.compress(data, compresslevel=RAW_GZIP_LEVEL))
+
+def copy_raw_page(src: str, dst: str, raw: Dict[str, Any]) -> None:
+    """304 时为本次 run 保存 raw：上次已是 .json.gz 就原样复制字节，旧版未压缩的 .json 重新压缩"""
+    if src.endswith(".gz"):
+        with open(src, "rb") as f:
+            write_bytes(dst, f.read())
+    else:
+        write_gzip_bytes(dst, dumps_json(raw, compact=True))
+
+def load_raw_page(path: str) -> Optional[Dict[str, Any]]:
+    """读 raw 页面：.json.gz 解压；旧版未压缩的 .json 照常读"""
+    if not path.endswith(".gz"):
+        return load_json_if_exists(path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return orjson.loads(gzip.decompress(f.read()))
 
 
 # ================== 网络 ==================
@@ -126,21 +190,58 @@ def build_session() -> requests.Session:
     s.headers.update({"User-Agent": UA})
     retry = Retry(
         total=3,
+        # 指数退避 1s/2s/4s，单次最多等 10s；加抖动避免多个 rid 线程同时重试
         backoff_factor=1,
+        backoff_max=10,
+        backoff_jitter=0.5,
         status_forcelist=[429, 500, 502, 503, 504],
         allowed_methods=["GET"],
         raise_on_status=False,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    # 多线程共用一个 session：连接池放大到不小于线程数，满了也不阻塞（多出的连接用完即丢）
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=32, pool_block=False)
     s.mount("http://", adapter)
     s.mount("https://", adapter)
     return s
 
-def fetch_dynamic_region_page(s: requests.Session, rid: int, pn: int, ps: int) -> Dict[str, Any]:
+def fetch_dynamic_region_page(
+    s: requests.Session,
+    rid: int,
+    pn: int,
+    ps: int,
+    http_cache: Optional[Dict[str, Dict[str, str]]] = None,
+) -> Tuple[Dict[str, Any], Optional[Dict[str, str]]]:
+    """
+    返回 (raw, validators)
+    - http_cache 有该页且上次的 raw 文件还在：带 If-None-Match / If-Modified-Since
+    - 304：返回 (上次的 raw, None)，调用方从 http_cache 的 raw_path 复制一份给本次 run
+    - 其它：validators 为响应里的 etag/last_modified（可能为空 dict）
+    """
     params = {"rid": rid, "pn": pn, "ps": ps}
-    r = s.get(API_DYNAMIC_REGION, params=params, timeout=TIMEOUT)
+    entry = http_cache.get(f"{rid}:{pn}") if http_cache is not None else None
+    headers: Dict[str, str] = {}
+    if entry and os.path.exists(entry.get("raw_path") or ""):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    r = s.get(API_DYNAMIC_REGION, params=params, headers=headers or None, timeout=TIMEOUT)
+    if r.status_code == 304 and headers:
+        cached = load_raw_page(entry["raw_path"])
+        if isinstance(cached, dict):
+            return cached, None
+        # 缓存文件损坏：去掉条件头重拉一次
+        return fetch_dynamic_region_page(s, rid, pn, ps)
     r.raise_for_status()
-    data = r.json()
+
+    validators: Dict[str, str] = {}
+    if r.headers.get("ETag"):
+        validators["etag"] = r.headers["ETag"]
+    if r.headers.get("Last-Modified"):
+        validators["last_modified"] = r.headers["Last-Modified"]
+
+    data = orjson.loads(r.content)
     if not isinstance(data, dict):
         raise RuntimeError(f"dynamic/region response not dict rid={rid} pn={pn} ps={ps}")
     if data.get("code") != 0:
@@ -148,19 +249,61 @@ def fetch_dynamic_region_page(s: requests.Session, rid: int, pn: int, ps: int) -
             f"dynamic/region error rid={rid} pn={pn} ps={ps}: "
             f"code={data.get('code')} msg={data.get('message')}"
         )
-    return data
+    return data, validators
 
 
 # ================== 规范化 ==================
+@dataclass
+class VideoRecord:
+    """
+    内存中的单条视频（字段顺序即落盘 JSON 的 key 顺序）
+    orjson 可直接序列化 dataclass；需要 dict 时用 to_dict()
+    """
+    bvid: str
+    aid: Optional[int]
+    title: Optional[str]
+    url: str
+    tid: Optional[int]
+    tname: Optional[str]
+    pubdate: Optional[int]
+    duration: Optional[int]
+    capture_ts: int
+    query_rid: Optional[int]
+    label: int
+    label_source: str
+    covered_until: Optional[int]
+    first_seen_ts: int
+    up: Dict[str, Any]
+    snapshots: Dict[str, Any]
+    features: Dict[str, Any]
+    # 手写 __slots__（按上面的字段顺序）：@dataclass(slots=True) 要 Python 3.10+，本项目仍支持 3.9
+    # 字段都没有默认值，所以可以和 @dataclass 一起用
+    __slots__ = tuple(__annotations__)
+
+    def to_dict(self) -> Dict[str, Any]:
+        # 浅拷贝即可（dataclasses.asdict 会深拷贝嵌套 dict，没有必要）
+        return {name: getattr(self, name) for name in self.__slots__}
+
+def legacy_view(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    给旧代码用：snapshots/features 补回 "0h"（== as_of_capture，共用同一个 dict）
+    原地修改并返回 record；run 文件 videos[i] 与聚合 captures 都适用
+    """
+    for k in ("snapshots", "features"):
+        d = record.get(k)
+        if isinstance(d, dict) and "as_of_capture" in d and "0h" not in d:
+            d["0h"] = d["as_of_capture"]
+    return record
+
 def normalize_dynamic_archives(
-    archives: List[Dict[str, Any]],
+    archives: Iterable[Dict[str, Any]],
     capture_ts: int,
-) -> List[Dict[str, Any]]:
+) -> List[VideoRecord]:
     """
     转成与你 v1/v2 同结构的 record（label=0），并加 capture_ts。
     同时保留 query_rid（本次请求使用的 rid），避免把 tid 当 rid 的语义误用。
     """
-    out: List[Dict[str, Any]] = []
+    out: List[VideoRecord] = []
 
     for a in archives or []:
         stat = a.get("stat") or {}
@@ -176,12 +319,16 @@ def normalize_dynamic_archives(
             age_hours = (capture_ts - pub_ts) / 3600.0
 
         view = stat.get("view", 0)
+        like = stat.get("like")
+        coin = stat.get("coin")
+        favorite = stat.get("favorite")
 
+        # 比率直接内联计算（原 safe_div：分子为 None 或分母为 None/0 时为 None）
         features_as_of_capture = {
-            "like_rate": safe_div(stat.get("like"), view),
-            "coin_rate": safe_div(stat.get("coin"), view),
-            "favorite_rate": safe_div(stat.get("favorite"), view),
-            "view_per_hour": safe_div(view, age_hours) if age_hours and age_hours > 0 else None,
+            "like_rate": like / view if like is not None and view else None,
+            "coin_rate": coin / view if coin is not None and view else None,
+            "favorite_rate": favorite / view if favorite is not None and view else None,
+            "view_per_hour": view / age_hours if view is not None and age_hours and age_hours > 0 else None,
             "age_hours": age_hours,
         }
 
@@ -192,117 +339,117 @@ def normalize_dynamic_archives(
         # ✅ 本页请求使用的 rid（由主流程注入到 archive["_query_rid"]）
         query_rid = a.get("_query_rid")
 
+        snap = {
+            "ts": capture_ts,
+            "view": stat.get("view"),
+            "like": like,
+            "coin": coin,
+            "favorite": favorite,
+            "reply": stat.get("reply"),
+            "danmaku": stat.get("danmaku"),
+            "share": stat.get("share"),
+        }
+
         out.append(
-            {
-                "bvid": bvid,
-                "aid": a.get("aid"),
-                "title": a.get("title"),
-                "url": f"https://www.bilibili.com/video/{bvid}",
-                "tid": a.get("tid"),
-                "tname": a.get("tname"),
-                "pubdate": pub_ts,
-                "duration": a.get("duration"),
+            VideoRecord(
+                bvid=bvid,
+                aid=a.get("aid"),
+                title=a.get("title"),
+                url=URL_PREFIX + bvid,
+                tid=a.get("tid"),
+                tname=a.get("tname"),
+                pubdate=pub_ts,
+                duration=a.get("duration"),
 
                 # ✅ 本条视频抓取时间
-                "capture_ts": capture_ts,
+                capture_ts=capture_ts,
 
                 # ✅ 本次分页请求参数 rid（避免把 tid 当 rid）
-                "query_rid": query_rid,
+                query_rid=query_rid,
 
                 # 负样本候选
-                "label": 0,
-                "label_source": "dynamic_region",
-                "covered_until": covered_until_ts,
+                label=0,
+                label_source="dynamic_region",
+                covered_until=covered_until_ts,
 
                 # 追溯
-                "first_seen_ts": capture_ts,
+                first_seen_ts=capture_ts,
 
-                "up": {
+                up={
                     "mid": owner.get("mid"),
                     "name": owner.get("name"),
                     # 接口可能没有 follower 字段，保留为可选
                     "follower": owner.get("follower"),
                 },
 
-                "snapshots": {
-                    "as_of_capture": {
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                    # 兼容旧字段名：0h == 本次抓取时刻
-                    "0h": {
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                },
-                "features": {
-                    "as_of_capture": features_as_of_capture,
-                    "0h": features_as_of_capture,  # 兼容旧字段名
-                },
-            }
+                # 只存 as_of_capture；旧字段名 0h 由 legacy_view() 在读取时补回
+                snapshots={"as_of_capture": snap},
+                features={"as_of_capture": features_as_of_capture},
+            )
         )
 
     return out
 
 
 # ================== 统计（与 v1 一致 + 额外新增更准确字段名） ==================
+def _new_cat_bucket() -> Dict[str, Any]:
+    return {
+        "tname": None,
+        "video_count": 0,
+        "view_sum": 0.0,
+        "view_cnt": 0,
+        "like_rate_sum": 0.0,
+        "like_rate_cnt": 0,
+    }
+
 def recompute_run_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
     videos = doc.get("videos", []) or []
 
     doc["count"] = len(videos)
 
-    doc.setdefault("meta", {})
-    doc["meta"]["pos_count"] = len([v for v in videos if v.get("label") == 1])
-    doc["meta"]["neg_count"] = len([v for v in videos if v.get("label") == 0])
-    doc["meta"]["total_count"] = len(videos)
-
-    cat: Dict[str, Dict[str, Any]] = {}
+    # 单次遍历：pos/neg 计数与分区统计一起做
+    pos = 0
+    neg = 0
+    num_types = (int, float)
+    cat: Dict[int, Dict[str, Any]] = defaultdict(_new_cat_bucket)
     for v in videos:
-        tid = v.get("tid")
+        label = v.label
+        if label == 1:
+            pos += 1
+        elif label == 0:
+            neg += 1
+
+        tid = v.tid
         if tid is None:
             continue
-        tid_str = str(tid)
-        tname = v.get("tname")
 
-        snaps = (v.get("snapshots") or {})
+        snaps = (v.snapshots or {})
         snap = snaps.get("as_of_capture") or snaps.get("0h") or {}
         view_as_of = snap.get("view")
 
-        feats = (v.get("features") or {})
+        feats = (v.features or {})
         feat = feats.get("as_of_capture") or feats.get("0h") or {}
         like_rate_as_of = feat.get("like_rate")
 
-        if tid_str not in cat:
-            cat[tid_str] = {
-                "tname": tname,
-                "video_count": 0,
-                "view_sum": 0.0,
-                "view_cnt": 0,
-                "like_rate_sum": 0.0,
-                "like_rate_cnt": 0,
-            }
+        # 每条视频只查一次 cat；首次出现的 tid 由 defaultdict 建桶
+        # int key 直接哈希，不再每条 str(tid)；写盘时 OPT_NON_STR_KEYS 转成字符串 key
+        bucket = cat[tid]
+        if not bucket["video_count"]:
+            bucket["tname"] = v.tname
+        bucket["video_count"] += 1
 
-        cat[tid_str]["video_count"] += 1
+        if isinstance(view_as_of, num_types):
+            bucket["view_sum"] += float(view_as_of)
+            bucket["view_cnt"] += 1
 
-        if isinstance(view_as_of, (int, float)):
-            cat[tid_str]["view_sum"] += float(view_as_of)
-            cat[tid_str]["view_cnt"] += 1
+        if isinstance(like_rate_as_of, num_types):
+            bucket["like_rate_sum"] += float(like_rate_as_of)
+            bucket["like_rate_cnt"] += 1
 
-        if isinstance(like_rate_as_of, (int, float)):
-            cat[tid_str]["like_rate_sum"] += float(like_rate_as_of)
-            cat[tid_str]["like_rate_cnt"] += 1
+    doc.setdefault("meta", {})
+    doc["meta"]["pos_count"] = pos
+    doc["meta"]["neg_count"] = neg
+    doc["meta"]["total_count"] = len(videos)
 
     out: Dict[str, Dict[str, Any]] = {}
     for tid, s in cat.items():
@@ -326,24 +473,20 @@ def recompute_run_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
 
 # ================== 聚合：按 bvid，把不同时间抓到的数据挂到 captures 下 ==================
 def _unique_capture_key(capture_ts: int, run_id: str, existing_captures: Dict[str, Any]) -> str:
-    base = str(capture_ts)
-    if base not in existing_captures:
-        return base
-    k = f"{base}__{run_id}"
+    """
+    确定性 key：<capture_ts>__<run_id>（run_id 精确到毫秒，跨 run 不会重复）
+    同一 run 内同一 bvid 出现多次（翻页偏移 / 跨 rid）时追加当前 captures 数量，O(1) 且不会重复
+    """
+    k = f"{capture_ts}__{run_id}"
     if k not in existing_captures:
         return k
-    i = 2
-    while True:
-        kk = f"{k}__{i}"
-        if kk not in existing_captures:
-            return kk
-        i += 1
-
-def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH) -> Dict[str, Any]:
-    agg = load_json_if_exists(agg_path) or {
+    return f"{k}__{len(existing_captures)}"
+
+def _new_agg_index(created_ts: Any) -> Dict[str, Any]:
+    return {
         "source": "bilibili_dynamic_region",
-        "created_ts": run_doc.get("capture_ts"),
-        "last_update_ts": run_doc.get("capture_ts"),
+        "created_ts": created_ts,
+        "last_update_ts": created_ts,
         "videos_by_bvid": {},
         "meta": {
             "video_unique_count": 0,
@@ -351,86 +494,257 @@ def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH)
         },
     }
 
-    agg["last_update_ts"] = run_doc.get("capture_ts")
-    videos_by_bvid: Dict[str, Any] = agg.get("videos_by_bvid") or {}
+def append_ndjson(path: str, rows: List[Dict[str, Any]]) -> None:
+    """追加写入 NDJSON：整批序列化后一次 write"""
+    if not rows:
+        return
+    # OPT_APPEND_NEWLINE 在序列化时直接带上换行，省掉每行一次 bytes 拼接
+    data = b"".join([orjson.dumps(r, option=_OPT_NDJSON) for r in rows])
+    with open(path, "ab") as f:
+        f.write(data)
+
+def _migrate_legacy_aggregate(index_path: str, captures_path: str) -> Optional[Dict[str, Any]]:
+    """
+    旧版 region_history.json → captures NDJSON + index（只在 index 尚不存在时执行一次）
+    captures 按原有 key 顺序写出；load_aggregate_history 重建时统一用 <ts>__<run_id> 作 key
+    """
+    legacy = load_json_if_exists(AGG_PATH)
+    if not legacy:
+        return None
+
+    index = _new_agg_index(legacy.get("created_ts"))
+    index["last_update_ts"] = legacy.get("last_update_ts")
+    nodes = index["videos_by_bvid"]
+    rows: List[Dict[str, Any]] = []
+    for bvid, node in (legacy.get("videos_by_bvid") or {}).items():
+        meta_node = {k: v for k, v in node.items() if k != "captures"}
+        captures = node.get("captures") or {}
+        meta_node["captures_count"] = len(captures)
+        nodes[bvid] = meta_node
+        for cap in captures.values():
+            rows.append({"bvid": bvid, **cap})
+
+    index["meta"]["video_unique_count"] = len(nodes)
+    index["meta"]["capture_record_count"] = (legacy.get("meta") or {}).get("capture_record_count", len(rows))
+    append_ndjson(captures_path, rows)
+    save_json(index_path, index)
+    return index
+
+def update_aggregate_history(
+    run_doc: Dict[str, Any],
+    index_path: str = AGG_INDEX_PATH,
+    captures_path: str = AGG_CAPTURES_PATH,
+) -> Dict[str, Any]:
+    """
+    本次 run 的每条视频追加一行 capture 到 NDJSON；index 只更新元信息与 captures_count
+    写入量只与本次 run 相关，不再随历史增长
+    """
+    index = load_json_if_exists(index_path) or _migrate_legacy_aggregate(index_path, captures_path) \
+        or _new_agg_index(run_doc.get("capture_ts"))
+
+    index["last_update_ts"] = run_doc.get("capture_ts")
+    videos_by_bvid: Dict[str, Any] = index.get("videos_by_bvid") or {}
     run_id = run_doc.get("run_id") or "unknown_run"
     capture_ts = run_doc.get("capture_ts")
 
     added_records = 0
+    rows: List[Dict[str, Any]] = []
 
     for v in run_doc.get("videos", []) or []:
-        bvid = v.get("bvid")
+        bvid = v.bvid
         if not bvid:
             continue
 
+        title = v.title
+        url = v.url
+        tid = v.tid
+        tname = v.tname
+        pubdate = v.pubdate
+        up = v.up
+        label_source = v.label_source
+        cu_new = v.covered_until
+        fs_new = v.first_seen_ts
+
         node = videos_by_bvid.get(bvid)
         if not node:
             node = {
                 "bvid": bvid,
-                "aid": v.get("aid"),
-                "label": v.get("label"),  # 基本是 0
-                "label_source": v.get("label_source"),
-                "covered_until_latest": v.get("covered_until"),
-                "title": v.get("title"),
-                "url": v.get("url"),
-                "tid": v.get("tid"),
-                "tname": v.get("tname"),
-                "pubdate": v.get("pubdate"),
-                "up": v.get("up"),
-                "first_seen_ts": v.get("first_seen_ts"),
-                "captures": {},
+                "aid": v.aid,
+                "label": v.label,  # 基本是 0
+                "label_source": label_source,
+                "covered_until_latest": cu_new,
+                "title": title,
+                "url": url,
+                "tid": tid,
+                "tname": tname,
+                "pubdate": pubdate,
+                "up": up,
+                "first_seen_ts": fs_new,
+                "captures_count": 0,
             }
+            videos_by_bvid[bvid] = node
+        node_get = node.get
 
         # 固定字段：以最新覆盖（方便查）
-        node["title"] = v.get("title") or node.get("title")
-        node["url"] = v.get("url") or node.get("url")
-        node["tid"] = v.get("tid") if v.get("tid") is not None else node.get("tid")
-        node["tname"] = v.get("tname") or node.get("tname")
-        node["pubdate"] = v.get("pubdate") if v.get("pubdate") is not None else node.get("pubdate")
-        node["up"] = v.get("up") or node.get("up")
-        node["label_source"] = v.get("label_source") or node.get("label_source")
+        node["title"] = title or node_get("title")
+        node["url"] = url or node_get("url")
+        node["tid"] = coalesce(tid, node_get("tid"))
+        node["tname"] = tname or node_get("tname")
+        node["pubdate"] = coalesce(pubdate, node_get("pubdate"))
+        node["up"] = up or node_get("up")
+        node["label_source"] = label_source or node_get("label_source")
 
         # covered_until：取更晚的一个（更保守）
-        cu_old = node.get("covered_until_latest")
-        cu_new = v.get("covered_until")
+        cu_old = node_get("covered_until_latest")
         if isinstance(cu_old, int) and isinstance(cu_new, int):
             node["covered_until_latest"] = max(cu_old, cu_new)
         elif cu_old is None and isinstance(cu_new, int):
             node["covered_until_latest"] = cu_new
 
-        if isinstance(node.get("first_seen_ts"), int) and isinstance(v.get("first_seen_ts"), int):
-            node["first_seen_ts"] = min(node["first_seen_ts"], v["first_seen_ts"])
-        elif node.get("first_seen_ts") is None and isinstance(v.get("first_seen_ts"), int):
-            node["first_seen_ts"] = v["first_seen_ts"]
-
-        captures: Dict[str, Any] = node.get("captures") or {}
-        key = _unique_capture_key(int(v.get("capture_ts") or capture_ts), str(run_id), captures)
-
-        captures[key] = {
-            "ts": int(v.get("capture_ts") or capture_ts),
+        fs_old = node_get("first_seen_ts")
+        if isinstance(fs_old, int) and isinstance(fs_new, int):
+            node["first_seen_ts"] = min(fs_old, fs_new)
+        elif fs_old is None and isinstance(fs_new, int):
+            node["first_seen_ts"] = fs_new
+
+        # capture key 不在这里分配：读取时按追加顺序用 _unique_capture_key 重建
+        snap = v.snapshots.get("as_of_capture") or {}
+        feat = v.features.get("as_of_capture") or {}
+        rows.append({
+            "bvid": bvid,
+            "ts": int(v.capture_ts or capture_ts),
             "run_id": run_id,
             # ✅ 两个都存：query_rid 表示本次列表来自哪个请求参数 rid
-            "query_rid": v.get("query_rid"),
+            "query_rid": v.query_rid,
             # ✅ tid/tname 表示视频本身分区
-            "tid": v.get("tid"),
-            "tname": v.get("tname"),
-            "covered_until": v.get("covered_until"),
-            "snapshots": v.get("snapshots"),
-            "features": v.get("features"),
-        }
-
-        node["captures"] = captures
-        videos_by_bvid[bvid] = node
+            "tid": tid,
+            "tname": tname,
+            "covered_until": cu_new,
+            # 列顺序见 SNAP_COLUMNS / FEAT_COLUMNS（同时记在 index meta 里）
+            "snap": [snap.get(c) for c in SNAP_COLUMNS],
+            "feat": [feat.get(c) for c in FEAT_COLUMNS],
+        })
+
+        node["captures_count"] = node_get("captures_count", 0) + 1
         added_records += 1
 
-    agg["videos_by_bvid"] = videos_by_bvid
-    agg["meta"]["video_unique_count"] = len(videos_by_bvid)
-    agg["meta"]["capture_record_count"] = agg["meta"].get("capture_record_count", 0) + added_records
+    append_ndjson(captures_path, rows)
+
+    index["videos_by_bvid"] = videos_by_bvid
+    index["meta"]["video_unique_count"] = len(videos_by_bvid)
+    index["meta"]["capture_record_count"] = index["meta"].get("capture_record_count", 0) + added_records
+    index["meta"]["snap_columns"] = SNAP_COLUMNS
+    index["meta"]["feat_columns"] = FEAT_COLUMNS
+
+    save_json(index_path, index)
+    return index
 
-    save_json(agg_path, agg)
+def load_aggregate_history(
+    index_path: str = AGG_INDEX_PATH,
+    captures_path: str = AGG_CAPTURES_PATH,
+) -> Dict[str, Any]:
+    """
+    还原旧版 region_history.json 的结构（videos_by_bvid[bvid]["captures"][key]）
+    逐行流式读取 NDJSON，capture key 按追加顺序用 _unique_capture_key 分配；
+    列式 snap/feat 还原成 as_of_capture dict（迁移来的旧行本来就是 dict，原样保留），再经 legacy_view 补回 0h
+    """
+    agg = load_json_if_exists(index_path) or _new_agg_index(None)
+    meta = agg.get("meta") or {}
+    snap_cols = meta.pop("snap_columns", None) or SNAP_COLUMNS
+    feat_cols = meta.pop("feat_columns", None) or FEAT_COLUMNS
+    videos_by_bvid: Dict[str, Any] = agg.get("videos_by_bvid") or {}
+    # 建 node 时就挂好空 captures，并直接按 bvid 索引到这个 dict，逐行只需一次查找
+    captures_of: Dict[str, Dict[str, Any]] = {}
+    for bvid, node in videos_by_bvid.items():
+        node.pop("captures_count", None)
+        captures_of[bvid] = node["captures"] = {}
+
+    if os.path.exists(captures_path):
+        with open(captures_path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                cap = orjson.loads(line)
+                captures = captures_of.get(cap.pop("bvid", None))
+                if captures is None:
+                    continue
+                if "snap" in cap:
+                    cap["snapshots"] = {"as_of_capture": dict(zip(snap_cols, cap.pop("snap")))}
+                    cap["features"] = {"as_of_capture": dict(zip(feat_cols, cap.pop("feat", None) or ()))}
+                key = _unique_capture_key(cap.get("ts"), str(cap.get("run_id")), captures)
+                captures[key] = legacy_view(cap)
+
+    agg["videos_by_bvid"] = videos_by_bvid
     return agg
 
 
+# ================== 抓取：单个 rid 的翻页（在线程池中执行） ==================
+def crawl_rid(
+    s: requests.Session,
+    rid: int,
+    date: str,
+    run_id: str,
+    capture_ts: int,
+    io_pool: ThreadPoolExecutor,
+    pending_writes: List[Future],
+    http_cache: Dict[str, Dict[str, str]],
+) -> Tuple[List[VideoRecord], int, int, Dict[str, Dict[str, str]]]:
+    """
+    返回 (本 rid 的 VideoRecord, archives 条数, 成功抓取的页数, 新的 http_cache 条目)
+    raw 页面在本线程序列化成 bytes 后交给 io_pool 写盘（之后注入 _query_rid 不会影响已保存内容）
+    每页抓完立即 normalize，原始 archives 不跨页保留
+    http_cache 在本线程只读；新条目返回给主线程，等 raw 写完后再合并（条目里的 raw_path 一定是完整文件）
+    """
+    cache_updates: Dict[str, Dict[str, str]] = {}
+    rid_videos: List[VideoRecord] = []
+    archive_cnt = 0
+    pages = 0
+
+    for pn in range(1, PN_MAX + 1):
+        # ✅ 更鲁棒：单页失败不让全局崩掉
+        try:
+            raw, validators = fetch_dynamic_region_page(s, rid=rid, pn=pn, ps=PS, http_cache=http_cache)
+        except Exception as e:
+            # 尽可能留日志，继续下一个 rid
+            print(f"[WARN] rid={rid} pn={pn} fetch failed: {e}; stop this rid.")
+            break
+
+        # ✅ 每页 raw 只保存一次：包含 run_id/rid/pn/ps
+        # 304 命中缓存时内容与上次 raw 相同：复制上次的文件，不再重新序列化/压缩
+        raw_path = os.path.join(
+            RAW_DIR, f"{date}__run_{run_id}__rid{rid}__pn{pn}__ps{PS}.json.gz"
+        )
+        if validators is None:
+            pending_writes.append(
+                io_pool.submit(copy_raw_page, http_cache[f"{rid}:{pn}"]["raw_path"], raw_path, raw)
+            )
+        else:
+            pending_writes.append(io_pool.submit(write_gzip_bytes, raw_path, dumps_json(raw, compact=True)))
+            if validators:
+                cache_updates[f"{rid}:{pn}"] = {**validators, "raw_path": raw_path}
+
+        data = raw.get("data") or {}
+        archives = data.get("archives") or []
+
+        # ✅ 如果这一页没有内容：停止当前 rid（符合常见分页逻辑）
+        if not archives:
+            print(f"[INFO] rid={rid} pn={pn} empty, stop this rid.")
+            break
+
+        # ✅ 注入 query_rid，后续 normalize/agg 不会把 tid 当 rid
+        for a in archives:
+            if isinstance(a, dict):
+                a["_query_rid"] = rid
+
+        rid_videos.extend(normalize_dynamic_archives(archives, capture_ts))
+        archive_cnt += len(archives)
+        pages += 1
+        time.sleep(SLEEP_BETWEEN_PAGES)
+
+    print(f"[INFO] rid={rid} collected={archive_cnt}")
+    return rid_videos, archive_cnt, pages, cache_updates
+
+
 # ================== 主流程：每次 run 独立 + 更新聚合总文件 ==================
 def main() -> None:
     ensure_dirs()
@@ -465,64 +779,51 @@ def main() -> None:
         "category_stats": {},
     }
 
-    all_archives: List[Dict[str, Any]] = []
+    videos: List[VideoRecord] = []
+    archives_fetched = 0
     pages_fetched = 0
 
+    http_cache: Dict[str, Dict[str, str]] = load_json_if_exists(HTTP_CACHE_PATH) or {}
+
     s = build_session()
+    io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS)
+    pending_writes: List[Future] = []
+    cache_updates: Dict[str, Dict[str, str]] = {}
     try:
-        for rid in RID_LIST:
-            rid_collected = 0
-
-            for pn in range(1, PN_MAX + 1):
-                # ✅ 更鲁棒：单页失败不让全局崩掉
-                try:
-                    raw = fetch_dynamic_region_page(s, rid=rid, pn=pn, ps=PS)
-                except Exception as e:
-                    # 尽可能留日志，继续下一个 rid
-                    print(f"[WARN] rid={rid} pn={pn} fetch failed: {e}; stop this rid.")
-                    break
-
-                # ✅ 每页 raw 只保存一次：包含 run_id/rid/pn/ps
-                raw_path = os.path.join(
-                    RAW_DIR, f"{date}__run_{run_id}__rid{rid}__pn{pn}__ps{PS}.json"
-                )
-                save_json(raw_path, raw)
-
-                data = raw.get("data") or {}
-                archives = data.get("archives") or []
-
-                # ✅ 如果这一页没有内容：停止当前 rid（符合常见分页逻辑）
-                if not archives:
-                    print(f"[INFO] rid={rid} pn={pn} empty, stop this rid.")
-                    break
-
-                # ✅ 注入 query_rid，后续 normalize/agg 不会把 tid 当 rid
-                for a in archives:
-                    if isinstance(a, dict):
-                        a["_query_rid"] = rid
-
-                all_archives.extend(archives)
-                rid_collected += len(archives)
-                pages_fetched += 1
-                time.sleep(SLEEP_BETWEEN_PAGES)
-
-            print(f"[INFO] rid={rid} collected={rid_collected}")
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            results = ex.map(
+                lambda rid: crawl_rid(s, rid, date, run_id, ts, io_pool, pending_writes, http_cache),
+                RID_LIST,
+            )
+            # 按 RID_LIST 顺序汇总，结果与串行版本一致
+            for rid_videos, archive_cnt, pages, rid_cache in results:
+                videos.extend(rid_videos)
+                cache_updates.update(rid_cache)
+                archives_fetched += archive_cnt
+                pages_fetched += pages
     finally:
         s.close()
+        # 等所有 raw 写完；写盘异常在这里抛出
+        io_pool.shutdown(wait=True)
+        for fut in pending_writes:
+            fut.result()
+
+    # raw 全部写完才更新缓存：下次 304 时读到的不会是写了一半的 gzip
+    http_cache.update(cache_updates)
 
-    videos = normalize_dynamic_archives(all_archives, ts)
     doc["videos"] = videos
     doc = recompute_run_fields(doc)
 
     save_json(run_path, doc)
+    save_json(HTTP_CACHE_PATH, http_cache, compact=True)
 
-    agg = update_aggregate_history(doc, AGG_PATH)
+    agg = update_aggregate_history(doc)
 
     print(
         f"[OK] date={date} run_id={run_id} rids={len(RID_LIST)} pages={pages_fetched} "
-        f"archives={len(all_archives)} videos={len(videos)} -> {run_path}"
+        f"archives={archives_fetched} videos={len(videos)} -> {run_path}"
     )
-    print(f"[OK] agg -> {AGG_PATH} (unique_videos={agg['meta']['video_unique_count']})")
+    print(f"[OK] agg -> {AGG_CAPTURES_PATH} + {AGG_INDEX_PATH} (unique_videos={agg['meta']['video_unique_count']})")
 
 
 if __name__ == "__main__":
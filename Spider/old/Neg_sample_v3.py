@@ -4,12 +4,14 @@ Week2 Step2 (Negative candidates) - dynamic/region
 目标：完全“模仿 popular 的结构”，同时满足你新增的 daily 单文件按时间戳归档。
 
 保留：
-- data/raw/Neg/                 每页 raw 原始响应（不覆盖）
-- data/runs/Neg/                每次运行 processed 文件（不合并、不覆盖）
+- data/raw/Neg/                 每页 raw 原始响应（不覆盖，.json.gz）
+- data/runs/Neg/                每次运行 processed 文件（不合并、不覆盖；NDJSON：header / 每条视频 / summary）
 
 新增：
-- data/agg/region_history.json
-  按 bvid 聚合历史：videos_by_bvid[bvid].captures[<capture_ts_key>] = 本次抓到的快照/特征
+- data/agg/region_history.sqlite3（WAL）
+  按 bvid 聚合历史：videos 表存每个 bvid 的元信息，captures 表每次抓取插入一行；
+  每次 run 只 upsert 本次出现的 bvid。旧版 jsonl/json 聚合首次运行时自动导入
+  load_aggregate_history() / --export-agg 还原成旧版 videos_by_bvid[bvid].captures[<capture_ts_key>] 嵌套结构
 
 - data/daily/Neg/<YYYY-MM-DD>.json
   ✅ daily 文件夹只存 1 个文件（每天一个），并按时间戳分类：
@@ -21,6 +23,7 @@ API:
 
 用法：
   python v2_region_negative_run_crawler.py
+  python v2_region_negative_run_crawler.py --export-agg [PATH]   # 只导出聚合 JSON，不抓取
 
 可改参数：
   RID_LIST, PN_MAX, PS, OBS_HOURS
@@ -28,12 +31,19 @@ API:
 
 from __future__ import annotations
 
-import json
+import argparse
+import gzip
 import os
+import sqlite3
+import threading
 import time
-from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -48,11 +58,30 @@ RAW_DIR = os.path.join(DATA_DIR, "raw", "Neg")          # 每页 raw（不覆盖
 RUN_DIR = os.path.join(DATA_DIR, "runs", "Neg")         # 每次运行 processed（不合并、不覆盖）
 DAILY_DIR = os.path.join(DATA_DIR, "daily", "Neg")      # 每天一个文件，按时间戳分类（新增）
 AGG_DIR = os.path.join(DATA_DIR, "agg")
+AGG_DB_PATH = os.path.join(AGG_DIR, "region_history.sqlite3")
+AGG_EXPORT_PATH = os.path.join(AGG_DIR, "region_history_export.json")  # export_aggregate_json 默认输出
+# 读已有 node 时每条 IN 查询的 bvid 数（低于 SQLite 旧版本 999 个参数的上限）
+AGG_LOAD_BATCH = 500
+# 旧的文件版聚合（仅用于一次性迁移进 SQLite）
 AGG_PATH = os.path.join(AGG_DIR, "region_history.json")
+AGG_CAPTURES_PATH = os.path.join(AGG_DIR, "region_history.jsonl")
+AGG_INDEX_PATH = os.path.join(AGG_DIR, "region_history_index.json")
 
 TIMEOUT = 15
 SLEEP_BETWEEN_PAGES = 0.2
 
+# raw 页面 gzip 压缩级别
+RAW_GZIP_LEVEL = 1
+
+# 每个 rid 先抓 pn=1，非空再按 PAGE_WINDOW 页一组并发抓 pn=2..PN_MAX；结果仍按 pn 顺序处理
+PAGE_WORKERS = 8
+# 每个 rid 一次最多派发的页数：遇到空页/错误停止时，多抓的页最多 PAGE_WINDOW - 1 个
+PAGE_WINDOW = 3
+# 各 rid 之间没有数据依赖：按 rid 并发，每个线程用自己的 session；
+# 同时在途（已提交、结果未写出）的 rid 也不超过 RID_WORKERS，内存只保留这么多个 rid 的视频
+# 请求速率不随并发放大：所有线程共用 wait_request_slot()，相邻请求至少相隔 SLEEP_BETWEEN_PAGES
+RID_WORKERS = 8
+
 # 默认抓一些主分区（可自行加 rid）
 RID_LIST: List[int] = [
     1,    # 动画
@@ -81,6 +110,11 @@ PS = 50
 
 # 观察窗口（负样本候选 covered_until = pubdate + OBS_HOURS）
 OBS_HOURS = 48
+_OBS_SECONDS = int(OBS_HOURS * 3600)
+
+# 是否在 snapshots/features 里额外写旧字段名 "0h"（与 as_of_capture 同一对象）
+# 下游统计已优先读 as_of_capture，默认不再重复写出
+EMIT_LEGACY_0H = False
 
 
 # ================== 工具函数 ==================
@@ -94,31 +128,49 @@ def now_ts() -> int:
     return int(time.time())
 
 def today_str(ts: int) -> str:
-    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
-
-def datetime_compact(ts: int) -> str:
-    # 带毫秒，避免同秒覆盖
-    return datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H-%M-%S") + f".{int((time.time() % 1) * 1000):03d}"
+    lt = time.localtime(ts)
+    return f"{lt.tm_year:04d}-{lt.tm_mon:02d}-{lt.tm_mday:02d}"
 
-def safe_div(a: Optional[float], b: Optional[float]) -> Optional[float]:
-    if a is None or b in (None, 0):
-        return None
-    return a / b
+def datetime_compact(ts: Optional[float] = None) -> str:
+    """
+    带毫秒，避免同秒覆盖；秒和毫秒取自同一个时间点（传入 time.time() 的 float）
+    例：2026-01-09T18-12-33.123
+    """
+    t = time.time() if ts is None else ts
+    sec = int(t)
+    ms = int((t - sec) * 1000)
+    lt = time.localtime(sec)
+    return (
+        f"{lt.tm_year:04d}-{lt.tm_mon:02d}-{lt.tm_mday:02d}"
+        f"T{lt.tm_hour:02d}-{lt.tm_min:02d}-{lt.tm_sec:02d}.{ms:03d}"
+    )
 
 def load_json_if_exists(path: str) -> Optional[Dict[str, Any]]:
     if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     return None
 
-def save_json(path: str, obj: Dict[str, Any]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+def save_json(path: str, obj: Dict[str, Any], pretty: bool = False) -> None:
+    """
+    orjson 直接输出 UTF-8 bytes，一次 write
+    默认紧凑输出（无缩进、无多余空白）：agg/daily 只给程序读，随历史增长，体积和耗时都约减半
+    pretty=True：缩进 2 格，给需要人看的文件
+    """
+    option = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS if pretty else orjson.OPT_NON_STR_KEYS
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(obj, option=option))
+
+def write_gzip_bytes(path: str, data: bytes) -> None:
+    # level 1：几乎不占 CPU，JSON 文本仍能压到原来的几分之一
+    with gzip.open(path, "wb", compresslevel=RAW_GZIP_LEVEL) as f:
+        f.write(data)
 
 def _unique_capture_key(capture_ts: int, run_id: str, existing: Dict[str, Any]) -> str:
     """
-    默认用 str(capture_ts) 作为 key。
-    若同一秒重复运行导致冲突，则自动加后缀："<ts>__<run_id>" 或再追加序号。
+    默认用 str(capture_ts) 作为 key；同一秒冲突时用 "<ts>__<run_id>"。
+    run_id 精确到毫秒，跨 run 基本不会再冲突；只有同一 run 内同一 bvid 出现多次时
+    才追加当前 captures 数量（O(1)、确定性，不再 while 探测）。
     """
     base = str(capture_ts)
     if base not in existing:
@@ -126,12 +178,7 @@ def _unique_capture_key(capture_ts: int, run_id: str, existing: Dict[str, Any])
     k = f"{base}__{run_id}"
     if k not in existing:
         return k
-    i = 2
-    while True:
-        kk = f"{k}__{i}"
-        if kk not in existing:
-            return kk
-        i += 1
+    return f"{k}__{len(existing)}"
 
 
 # ================== 网络 ==================
@@ -145,16 +192,44 @@ def build_session() -> requests.Session:
         allowed_methods=["GET"],
         raise_on_status=False,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    # 只访问 api.bilibili.com 一个 host：1 个连接池；session 由 thread_session() 按线程持有，
+    # 一个线程同一时刻只有 1 个请求，保留 2 个 keep-alive 连接足够复用 TLS；满了也不阻塞（多出的连接用完即丢）
+    adapter = HTTPAdapter(
+        max_retries=retry,
+        pool_connections=1,
+        pool_maxsize=2,
+        pool_block=False,
+    )
     s.mount("http://", adapter)
     s.mount("https://", adapter)
     return s
 
-def fetch_dynamic_region_page(s: requests.Session, rid: int, pn: int, ps: int) -> Dict[str, Any]:
+_pace_lock = threading.Lock()
+_next_request_ts = 0.0
+
+def wait_request_slot() -> None:
+    """
+    所有 rid/页线程共享的请求间隔：相邻两次请求至少相隔 SLEEP_BETWEEN_PAGES 秒，
+    总速率与串行版本一致，不随 RID_WORKERS × PAGE_WORKERS 的并发数放大（该接口容易 412）
+    """
+    global _next_request_ts
+    with _pace_lock:
+        now = time.monotonic()
+        delay = _next_request_ts - now
+        _next_request_ts = max(now, _next_request_ts) + SLEEP_BETWEEN_PAGES
+    if delay > 0:
+        time.sleep(delay)
+
+def fetch_dynamic_region_page(
+    s: requests.Session, rid: int, pn: int, ps: int
+) -> Tuple[Dict[str, Any], bytes]:
+    """返回 (解析后的 dict, 原始响应 bytes)；raw 直接落盘 bytes，不再重新序列化"""
+    wait_request_slot()
     params = {"rid": rid, "pn": pn, "ps": ps}
     r = s.get(API_DYNAMIC_REGION, params=params, timeout=TIMEOUT)
     r.raise_for_status()
-    data = r.json()
+    raw_bytes = r.content
+    data = orjson.loads(raw_bytes)
     if not isinstance(data, dict):
         raise RuntimeError(f"dynamic/region response not dict rid={rid} pn={pn} ps={ps}")
     # bilibili 有时返回 200 但 code != 0
@@ -162,179 +237,337 @@ def fetch_dynamic_region_page(s: requests.Session, rid: int, pn: int, ps: int) -
         raise RuntimeError(
             f"dynamic/region error rid={rid} pn={pn} ps={ps}: code={data.get('code')} msg={data.get('message')}"
         )
-    return data
+    return data, raw_bytes
+
+_tls = threading.local()
+_sessions: List[requests.Session] = []
+_sessions_lock = threading.Lock()
+
+def thread_session() -> requests.Session:
+    """每个线程第一次调用时建自己的 session（连接池不跨线程共享），之后复用"""
+    s = getattr(_tls, "session", None)
+    if s is None:
+        s = build_session()
+        _tls.session = s
+        with _sessions_lock:
+            _sessions.append(s)
+    return s
+
+def close_thread_sessions() -> None:
+    with _sessions_lock:
+        for s in _sessions:
+            s.close()
+        _sessions.clear()
+
+def fetch_page_safe(
+    rid: int, pn: int
+) -> Tuple[Optional[Dict[str, Any]], Optional[bytes], Optional[Exception]]:
+    """线程池里执行：异常不抛出，原样带回调用方按原来的 break/continue 规则处理"""
+    try:
+        raw, raw_bytes = fetch_dynamic_region_page(thread_session(), rid=rid, pn=pn, ps=PS)
+        return raw, raw_bytes, None
+    except Exception as e:
+        return None, None, e
+
+def iter_rid_pages(
+    pool: ThreadPoolExecutor, rid: int
+) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[bytes], Optional[Exception]]]:
+    """
+    按 pn 顺序产出 (pn, raw, raw_bytes, error)
+    pn=1 单独先抓：调用方在 pn=1 就停止时，后面的页不会被派发；
+    之后每次只派发 PAGE_WINDOW 页，当前一组处理完才派发下一组；
+    调用方中途 break 时生成器被关闭，本组尚未开始的请求会被取消
+    """
+    yield (1, *fetch_page_safe(rid, 1))
+    for start in range(2, PN_MAX + 1, PAGE_WINDOW):
+        pns = range(start, min(start + PAGE_WINDOW, PN_MAX + 1))
+        for pn, res in zip(pns, pool.map(lambda pn: fetch_page_safe(rid, pn), pns)):
+            yield (pn, *res)
 
 
 # ================== 规范化 ==================
+@dataclass
+class VideoRecord:
+    """
+    内存中的单条视频（字段顺序即落盘 JSON 的 key 顺序）
+    orjson 可直接序列化 dataclass；需要 dict 时用 to_dict()
+    """
+    bvid: str
+    aid: Optional[int]
+    label: int
+    label_source: str
+    capture_ts: int
+    title: Optional[str]
+    url: str
+    request_rid: int
+    tid: Optional[int]
+    tname: Optional[str]
+    pubdate: Optional[int]
+    duration: Optional[int]
+    covered_until: Optional[int]
+    first_seen_ts: int
+    up: Dict[str, Any]
+    snapshots: Dict[str, Any]
+    features: Dict[str, Any]
+    # 手写 __slots__（按上面的字段顺序）：@dataclass(slots=True) 要 Python 3.10+，本项目仍支持 3.9
+    # 字段都没有默认值，所以可以和 @dataclass 一起用
+    __slots__ = tuple(__annotations__)
+
+    def to_dict(self) -> Dict[str, Any]:
+        # 浅拷贝即可（dataclasses.asdict 会深拷贝嵌套 dict，没有必要）
+        return {name: getattr(self, name) for name in self.__slots__}
+
 def normalize_dynamic_archives(
     archives: List[Dict[str, Any]],
     capture_ts: int,
     request_rid: int
-) -> List[Dict[str, Any]]:
+) -> List[VideoRecord]:
     """
     转成与你 popular 脚本同风格的 record（label=0），并加 capture_ts。
     额外：写入 request_rid（你这次调用 dynamic/region 的 rid），避免和 tid 混淆。
     """
-    out: List[Dict[str, Any]] = []
+    out: List[VideoRecord] = []
 
     for a in archives or []:
-        stat = a.get("stat") or {}
-        owner = a.get("owner") or {}
-
-        bvid = a.get("bvid")
+        get = a.get
+        bvid = get("bvid")
         if not bvid:
             continue
 
-        pub_ts = a.get("pubdate")
+        stat_get = (get("stat") or {}).get
+        owner = get("owner") or {}
+
+        pub_ts = get("pubdate")
         age_hours: Optional[float] = None
+        covered_until_ts: Optional[int] = None
         if isinstance(pub_ts, int) and pub_ts > 0:
             age_hours = (capture_ts - pub_ts) / 3600.0
+            covered_until_ts = pub_ts + _OBS_SECONDS
 
-        view = stat.get("view", 0)
+        # stat 每个字段只取一次，snap 与 features 共用；比值在分母为 None / 0 时无意义
+        view = stat_get("view", 0)
+        like = stat_get("like")
+        coin = stat_get("coin")
+        favorite = stat_get("favorite")
 
         features_as_of_capture = {
-            "like_rate": safe_div(stat.get("like"), view),
-            "coin_rate": safe_div(stat.get("coin"), view),
-            "favorite_rate": safe_div(stat.get("favorite"), view),
-            "view_per_hour": safe_div(view, age_hours) if age_hours and age_hours > 0 else None,
+            "like_rate": (like / view) if like is not None and view else None,
+            "coin_rate": (coin / view) if coin is not None and view else None,
+            "favorite_rate": (favorite / view) if favorite is not None and view else None,
+            "view_per_hour": (view / age_hours) if view is not None and age_hours and age_hours > 0 else None,
             "age_hours": age_hours,
         }
 
-        covered_until_ts: Optional[int] = None
-        if isinstance(pub_ts, int) and pub_ts > 0:
-            covered_until_ts = pub_ts + int(OBS_HOURS * 3600)
+        snap = {
+            "ts": capture_ts,
+            "view": stat_get("view"),
+            "like": like,
+            "coin": coin,
+            "favorite": favorite,
+            "reply": stat_get("reply"),
+            "danmaku": stat_get("danmaku"),
+            "share": stat_get("share"),
+        }
+        snapshots = {"as_of_capture": snap}
+        features = {"as_of_capture": features_as_of_capture}
+        if EMIT_LEGACY_0H:
+            # 兼容旧字段名（不要当“发布后0小时”理解）；共享同一个 dict，不额外占内存
+            snapshots["0h"] = snap
+            features["0h"] = features_as_of_capture
 
         out.append(
-            {
-                "bvid": bvid,
-                "aid": a.get("aid"),
-                "label": 0,
-                "label_source": "dynamic_region",
+            VideoRecord(
+                bvid=bvid,
+                aid=a.get("aid"),
+                label=0,
+                label_source="dynamic_region",
 
                 # ✅ 本条视频抓取时间
-                "capture_ts": capture_ts,
+                capture_ts=capture_ts,
 
-                "title": a.get("title"),
-                "url": f"https://www.bilibili.com/video/{bvid}",
+                title=a.get("title"),
+                url=f"https://www.bilibili.com/video/{bvid}",
 
                 # ✅ 两套：request_rid（接口参数） + tid/tname（视频自身分区）
-                "request_rid": request_rid,
-                "tid": a.get("tid"),
-                "tname": a.get("tname"),
+                request_rid=request_rid,
+                tid=a.get("tid"),
+                tname=a.get("tname"),
 
-                "pubdate": pub_ts,
-                "duration": a.get("duration"),
+                pubdate=pub_ts,
+                duration=a.get("duration"),
 
                 # 负样本候选窗口
-                "covered_until": covered_until_ts,
+                covered_until=covered_until_ts,
 
                 # 追溯
-                "first_seen_ts": capture_ts,
+                first_seen_ts=capture_ts,
 
-                "up": {
+                up={
                     "mid": owner.get("mid"),
                     "name": owner.get("name"),
                     "follower": owner.get("follower"),
                 },
 
-                "snapshots": {
-                    "as_of_capture": {
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                    "0h": {  # 兼容旧字段名（不要当“发布后0小时”理解）
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                },
-                "features": {
-                    "as_of_capture": features_as_of_capture,
-                    "0h": features_as_of_capture,
-                },
-            }
+                snapshots=snapshots,
+                features=features,
+            )
         )
 
     return out
 
 
 # ================== 统计（与你 popular 一致） ==================
-def recompute_run_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
-    videos = doc.get("videos", []) or []
-
-    doc["count"] = len(videos)
-
-    doc.setdefault("meta", {})
-    doc["meta"]["pos_count"] = len([v for v in videos if v.get("label") == 1])
-    doc["meta"]["neg_count"] = len([v for v in videos if v.get("label") == 0])
-    doc["meta"]["total_count"] = len(videos)
+_EMPTY: Dict[str, Any] = {}
+
+def _new_cat_bucket() -> Dict[str, Any]:
+    return {
+        "tname": None,
+        "video_count": 0,
+        "view_sum": 0,
+        "view_cnt": 0,
+        "like_rate_sum": 0.0,
+        "like_rate_cnt": 0,
+    }
 
-    cat: Dict[str, Dict[str, Any]] = {}
-    for v in videos:
-        tid = v.get("tid")
+class RunStats:
+    """
+    在线累计 run 统计（pos/neg/count/category_stats）：边抓边 add，不需要保留全部 videos
+    输出与原 recompute_run_fields 一致
+    """
+    __slots__ = ("count", "pos", "neg", "cat")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.pos = 0
+        self.neg = 0
+        self.cat: Dict[str, Dict[str, Any]] = defaultdict(_new_cat_bucket)
+
+    def add(self, v: VideoRecord) -> None:
+        self.count += 1
+        label = v.label
+        if label == 1:
+            self.pos += 1
+        elif label == 0:
+            self.neg += 1
+
+        tid = v.tid
         if tid is None:
-            continue
-        tid = str(tid)
-        tname = v.get("tname")
-
-        snaps = (v.get("snapshots") or {})
-        snap = snaps.get("as_of_capture") or snaps.get("0h") or {}
-        view_as_of = snap.get("view")
-
-        feats = (v.get("features") or {})
-        feat = feats.get("as_of_capture") or feats.get("0h") or {}
-        like_rate_as_of = feat.get("like_rate")
-
-        if tid not in cat:
-            cat[tid] = {
-                "tname": tname,
-                "video_count": 0,
-                "view_sum": 0,
-                "view_cnt": 0,
-                "like_rate_sum": 0.0,
-                "like_rate_cnt": 0,
+            return
+
+        snaps = v.snapshots or _EMPTY
+        view_as_of = (snaps.get("as_of_capture") or snaps.get("0h") or _EMPTY).get("view")
+
+        feats = v.features or _EMPTY
+        like_rate_as_of = (feats.get("as_of_capture") or feats.get("0h") or _EMPTY).get("like_rate")
+
+        bucket = self.cat[str(tid)]
+        if not bucket["video_count"]:
+            bucket["tname"] = v.tname
+        bucket["video_count"] += 1
+
+        # 常见情况是数值：直接累加，不做类型判断；None/非数值在 += 时抛 TypeError 跳过
+        # （不用 `or 0` 兜底：view=0 的视频也要计入 view_cnt，否则均值会变）
+        try:
+            bucket["view_sum"] += view_as_of
+            bucket["view_cnt"] += 1
+        except TypeError:
+            pass
+
+        try:
+            bucket["like_rate_sum"] += like_rate_as_of
+            bucket["like_rate_cnt"] += 1
+        except TypeError:
+            pass
+
+    def apply(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """把统计写进 doc 的 count/meta/category_stats"""
+        doc["count"] = self.count
+
+        doc.setdefault("meta", {})
+        doc["meta"]["pos_count"] = self.pos
+        doc["meta"]["neg_count"] = self.neg
+        doc["meta"]["total_count"] = self.count
+
+        out: Dict[str, Dict[str, Any]] = {}
+        for tid, s in self.cat.items():
+            out[tid] = {
+                "tname": s["tname"],
+                "video_count": s["video_count"],
+                "avg_view_0h": (s["view_sum"] / s["view_cnt"]) if s["view_cnt"] > 0 else None,
+                "avg_like_rate_0h": (s["like_rate_sum"] / s["like_rate_cnt"]) if s["like_rate_cnt"] > 0 else None,
             }
 
-        cat[tid]["video_count"] += 1
+        doc["category_stats"] = out
+        return doc
 
-        if isinstance(view_as_of, (int, float)):
-            cat[tid]["view_sum"] += view_as_of
-            cat[tid]["view_cnt"] += 1
+def iter_doc_videos(doc: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """doc["videos"] 逐条转成 dict：内存里是 VideoRecord，从旧 run 文件读入的已是 dict"""
+    for v in doc.get("videos", []) or []:
+        yield v.to_dict() if isinstance(v, VideoRecord) else v
 
-        if isinstance(like_rate_as_of, (int, float)):
-            cat[tid]["like_rate_sum"] += like_rate_as_of
-            cat[tid]["like_rate_cnt"] += 1
-
-    out: Dict[str, Dict[str, Any]] = {}
-    for tid, s in cat.items():
-        out[tid] = {
-            "tname": s["tname"],
-            "video_count": s["video_count"],
-            "avg_view_0h": (s["view_sum"] / s["view_cnt"]) if s["view_cnt"] > 0 else None,
-            "avg_like_rate_0h": (s["like_rate_sum"] / s["like_rate_cnt"]) if s["like_rate_cnt"] > 0 else None,
-        }
-
-    doc["category_stats"] = out
+def recompute_run_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """对已在内存里的 doc["videos"]（VideoRecord 列表）整体重算（单次遍历）"""
+    stats = RunStats()
+    for v in doc.get("videos", []) or []:
+        stats.add(v)
+    return stats.apply(doc)
+
+
+# ================== run 文件：NDJSON（header 行 + 每条视频一行 + summary 行） ==================
+_OPT_NDJSON = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+
+def iter_run_videos(run_path: str) -> Iterator[Dict[str, Any]]:
+    """流式读取 run 文件中的视频行（跳过 header / summary）"""
+    with open(run_path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = orjson.loads(line)
+            if "bvid" in rec:
+                yield rec
+
+def load_run_file(run_path: str) -> Dict[str, Any]:
+    """还原成旧版 run JSON 的结构（header 字段 + videos 列表 + summary 字段）"""
+    doc: Dict[str, Any] = {}
+    videos: List[Dict[str, Any]] = []
+    with open(run_path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = orjson.loads(line)
+            if "bvid" in rec:
+                videos.append(rec)
+            else:
+                doc.update(rec.get("header") or rec.get("summary") or {})
+    doc["videos"] = videos
     return doc
 
 
-# ================== 聚合：按 bvid，把不同时间抓到的数据挂到 captures 下（历史总文件） ==================
-def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH) -> Dict[str, Any]:
-    agg = load_json_if_exists(agg_path) or {
+# ================== 聚合：按 bvid，把不同时间抓到的数据挂到 captures 下（SQLite 历史库） ==================
+_AGG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    bvid TEXT PRIMARY KEY,
+    json BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    bvid TEXT NOT NULL,
+    capture_ts INTEGER,
+    run_id TEXT,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_bvid ON captures(bvid, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+"""
+
+def _new_agg_index(created_ts: Any) -> Dict[str, Any]:
+    return {
         "source": "bilibili_dynamic_region",
-        "created_ts": run_doc.get("capture_ts"),
-        "last_update_ts": run_doc.get("capture_ts"),
+        "created_ts": created_ts,
+        "last_update_ts": created_ts,
         "videos_by_bvid": {},
         "meta": {
             "video_unique_count": 0,
@@ -342,88 +575,282 @@ def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH)
         },
     }
 
-    agg["last_update_ts"] = run_doc.get("capture_ts")
-    videos_by_bvid: Dict[str, Any] = agg.get("videos_by_bvid") or {}
-    run_id = run_doc.get("run_id") or "unknown_run"
-    capture_ts = int(run_doc.get("capture_ts") or now_ts())
-
-    added_records = 0
+def open_agg_db(db_path: str = AGG_DB_PATH) -> sqlite3.Connection:
+    """autocommit 模式打开，事务由调用方显式 BEGIN/COMMIT；WAL + synchronous=NORMAL"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_AGG_SCHEMA)
+    return conn
+
+def _get_meta(conn: sqlite3.Connection) -> Dict[str, Any]:
+    return {k: orjson.loads(v) for k, v in conn.execute("SELECT key, value FROM meta")}
+
+def _put_meta(conn: sqlite3.Connection, meta: Dict[str, Any]) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)",
+        [(k, orjson.dumps(v)) for k, v in meta.items()],
+    )
 
-    for v in run_doc.get("videos", []) or []:
-        bvid = v.get("bvid")
-        if not bvid:
-            continue
+def _load_file_aggregate() -> Optional[Dict[str, Any]]:
+    """
+    读旧的文件版聚合（迁移用）：
+    - region_history.jsonl + region_history_index.json（captures 按追加顺序分配 key）
+    - 更早的整份 region_history.json
+    """
+    index = load_json_if_exists(AGG_INDEX_PATH)
+    if index is None:
+        return load_json_if_exists(AGG_PATH)
+
+    videos_by_bvid: Dict[str, Any] = index.get("videos_by_bvid") or {}
+    for node in videos_by_bvid.values():
+        node["captures"] = {}
+    if os.path.exists(AGG_CAPTURES_PATH):
+        with open(AGG_CAPTURES_PATH, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                cap = orjson.loads(line)
+                node = videos_by_bvid.get(cap.pop("bvid", None))
+                if node is None:
+                    continue
+                captures = node["captures"]
+                key = _unique_capture_key(int(cap.get("ts") or 0), str(cap.get("run_id")), captures)
+                captures[key] = cap
+    index["videos_by_bvid"] = videos_by_bvid
+    return index
+
+def _migrate_file_aggregate(conn: sqlite3.Connection) -> None:
+    """库为空且存在文件版聚合时导入一次（在调用方事务内执行）"""
+    if conn.execute("SELECT 1 FROM videos LIMIT 1").fetchone() is not None:
+        return
+    legacy = _load_file_aggregate()
+    if not legacy:
+        return
+
+    video_rows: List[Tuple[str, bytes]] = []
+    capture_rows: List[Tuple[str, Any, Any, bytes]] = []
+    for bvid, node in (legacy.get("videos_by_bvid") or {}).items():
+        captures = node.get("captures") or {}
+        meta_node = {k: v for k, v in node.items() if k != "captures"}
+        meta_node["captures_count"] = len(captures)
+        meta_node["last_capture_ts"] = max(
+            (c["ts"] for c in captures.values() if isinstance(c.get("ts"), int)), default=None
+        )
+        video_rows.append((bvid, orjson.dumps(meta_node)))
+        for cap in captures.values():
+            capture_rows.append((bvid, cap.get("ts"), cap.get("run_id"), orjson.dumps(cap)))
 
-        node = videos_by_bvid.get(bvid)
-        if not node:
-            node = {
-                "bvid": bvid,
-                "aid": v.get("aid"),
-                "label": v.get("label"),  # 基本是 0
-                "label_source": v.get("label_source"),
-                "covered_until_latest": v.get("covered_until"),
-                "title": v.get("title"),
-                "url": v.get("url"),
-                "tid": v.get("tid"),
-                "tname": v.get("tname"),
-                "pubdate": v.get("pubdate"),
-                "up": v.get("up"),
-                "first_seen_ts": v.get("first_seen_ts"),
-                "captures": {},
+    conn.executemany("INSERT INTO videos(bvid, json) VALUES(?, ?)", video_rows)
+    conn.executemany(
+        "INSERT INTO captures(bvid, capture_ts, run_id, payload) VALUES(?, ?, ?, ?)", capture_rows
+    )
+    legacy_meta = legacy.get("meta") or {}
+    _put_meta(conn, {
+        "source": legacy.get("source") or "bilibili_dynamic_region",
+        "created_ts": legacy.get("created_ts"),
+        "last_update_ts": legacy.get("last_update_ts"),
+        "capture_record_count": legacy_meta.get("capture_record_count", len(capture_rows)),
+    })
+
+def _iter_prefetched(
+    conn: sqlite3.Connection,
+    videos: Iterable[Dict[str, Any]],
+    nodes: Dict[str, Dict[str, Any]],
+    batch: int = AGG_LOAD_BATCH,
+) -> Iterator[Dict[str, Any]]:
+    """
+    按批产出 videos：每批先用一条 IN 查询把本批中尚未加载的已有 node 读进 nodes
+    只解析本次 run 涉及的 bvid，且查询次数从每条一次降到每批一次
+    """
+    it = iter(videos)
+    while True:
+        chunk = list(islice(it, batch))
+        if not chunk:
+            return
+        need = {bvid for v in chunk if (bvid := v.get("bvid")) and bvid not in nodes}
+        if need:
+            placeholders = ",".join("?" * len(need))
+            for bvid, js in conn.execute(
+                f"SELECT bvid, json FROM videos WHERE bvid IN ({placeholders})", tuple(need)
+            ):
+                nodes[bvid] = orjson.loads(js)
+        yield from chunk
+
+def update_aggregate_history(
+    run_doc: Dict[str, Any],
+    videos: Optional[Iterable[Dict[str, Any]]] = None,
+    db_path: str = AGG_DB_PATH,
+) -> Dict[str, Any]:
+    """
+    本次 run 的视频在一个事务里 upsert 到 videos、追加到 captures
+    videos 为 dict 的可迭代对象（如 iter_run_videos）；默认取 run_doc["videos"]（VideoRecord 经 iter_doc_videos 转成 dict）
+    只读写本次出现的 bvid，成本与历史总量无关；返回 meta 概要（不加载全部历史）
+    """
+    conn = open_agg_db(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _migrate_file_aggregate(conn)
+
+        meta = _get_meta(conn)
+        meta.setdefault("source", "bilibili_dynamic_region")
+        meta.setdefault("created_ts", run_doc.get("capture_ts"))
+        meta["last_update_ts"] = run_doc.get("capture_ts")
+        run_id = run_doc.get("run_id") or "unknown_run"
+        capture_ts = int(run_doc.get("capture_ts") or now_ts())
+
+        # 本次 run 涉及的 node（库里已有的由 _iter_prefetched 按批读入；同一 bvid 只查一次库）
+        nodes: Dict[str, Dict[str, Any]] = {}
+        capture_rows: List[Tuple[str, int, str, bytes]] = []
+
+        src = iter_doc_videos(run_doc) if videos is None else videos
+        for v in _iter_prefetched(conn, src, nodes):
+            bvid = v.get("bvid")
+            if not bvid:
+                continue
+
+            node = nodes.get(bvid)
+            if node is None:
+                node = {
+                    "bvid": bvid,
+                    "aid": v.get("aid"),
+                    "label": v.get("label"),  # 基本是 0
+                    "label_source": v.get("label_source"),
+                    "covered_until_latest": v.get("covered_until"),
+                    "title": v.get("title"),
+                    "url": v.get("url"),
+                    "tid": v.get("tid"),
+                    "tname": v.get("tname"),
+                    "pubdate": v.get("pubdate"),
+                    "up": v.get("up"),
+                    "first_seen_ts": v.get("first_seen_ts"),
+                    "captures_count": 0,
+                    "last_capture_ts": None,
+                }
+                nodes[bvid] = node
+
+            # 固定字段：以最新覆盖
+            node["title"] = v.get("title") or node.get("title")
+            node["url"] = v.get("url") or node.get("url")
+            node["tid"] = v.get("tid") if v.get("tid") is not None else node.get("tid")
+            node["tname"] = v.get("tname") or node.get("tname")
+            node["pubdate"] = v.get("pubdate") if v.get("pubdate") is not None else node.get("pubdate")
+            node["up"] = v.get("up") or node.get("up")
+            node["label_source"] = v.get("label_source") or node.get("label_source")
+
+            # covered_until：取更晚的（更保守）
+            cu_old = node.get("covered_until_latest")
+            cu_new = v.get("covered_until")
+            if isinstance(cu_old, int) and isinstance(cu_new, int):
+                node["covered_until_latest"] = max(cu_old, cu_new)
+            elif cu_old is None and isinstance(cu_new, int):
+                node["covered_until_latest"] = cu_new
+
+            # first_seen：取更早的
+            if isinstance(node.get("first_seen_ts"), int) and isinstance(v.get("first_seen_ts"), int):
+                node["first_seen_ts"] = min(node["first_seen_ts"], v["first_seen_ts"])
+            elif node.get("first_seen_ts") is None and isinstance(v.get("first_seen_ts"), int):
+                node["first_seen_ts"] = v["first_seen_ts"]
+
+            # capture key 不在这里分配：导出时按插入顺序用 _unique_capture_key 重建，与旧版一致
+            cap_ts = int(v.get("capture_ts") or capture_ts)
+            capture = {
+                "ts": cap_ts,
+                "run_id": run_id,
+                "request_rid": v.get("request_rid"),
+                "covered_until": v.get("covered_until"),
+                "snapshots": v.get("snapshots"),
+                "features": v.get("features"),
             }
+            capture_rows.append((bvid, cap_ts, run_id, orjson.dumps(capture, option=orjson.OPT_NON_STR_KEYS)))
 
-        # 固定字段：以最新覆盖
-        node["title"] = v.get("title") or node.get("title")
-        node["url"] = v.get("url") or node.get("url")
-        node["tid"] = v.get("tid") if v.get("tid") is not None else node.get("tid")
-        node["tname"] = v.get("tname") or node.get("tname")
-        node["pubdate"] = v.get("pubdate") if v.get("pubdate") is not None else node.get("pubdate")
-        node["up"] = v.get("up") or node.get("up")
-        node["label_source"] = v.get("label_source") or node.get("label_source")
-
-        # covered_until：取更晚的（更保守）
-        cu_old = node.get("covered_until_latest")
-        cu_new = v.get("covered_until")
-        if isinstance(cu_old, int) and isinstance(cu_new, int):
-            node["covered_until_latest"] = max(cu_old, cu_new)
-        elif cu_old is None and isinstance(cu_new, int):
-            node["covered_until_latest"] = cu_new
-
-        # first_seen：取更早的
-        if isinstance(node.get("first_seen_ts"), int) and isinstance(v.get("first_seen_ts"), int):
-            node["first_seen_ts"] = min(node["first_seen_ts"], v["first_seen_ts"])
-        elif node.get("first_seen_ts") is None and isinstance(v.get("first_seen_ts"), int):
-            node["first_seen_ts"] = v["first_seen_ts"]
-
-        captures: Dict[str, Any] = node.get("captures") or {}
-        key = _unique_capture_key(int(v.get("capture_ts") or capture_ts), str(run_id), captures)
-
-        captures[key] = {
-            "ts": int(v.get("capture_ts") or capture_ts),
-            "run_id": run_id,
-            "request_rid": v.get("request_rid"),
-            "covered_until": v.get("covered_until"),
-            "snapshots": v.get("snapshots"),
-            "features": v.get("features"),
-        }
+            node["captures_count"] = node.get("captures_count", 0) + 1
+            node["last_capture_ts"] = cap_ts
 
-        node["captures"] = captures
-        videos_by_bvid[bvid] = node
-        added_records += 1
+        conn.executemany(
+            "INSERT OR REPLACE INTO videos(bvid, json) VALUES(?, ?)",
+            [(bvid, orjson.dumps(node, option=orjson.OPT_NON_STR_KEYS)) for bvid, node in nodes.items()],
+        )
+        conn.executemany(
+            "INSERT INTO captures(bvid, capture_ts, run_id, payload) VALUES(?, ?, ?, ?)", capture_rows
+        )
+        meta["capture_record_count"] = meta.get("capture_record_count", 0) + len(capture_rows)
+        _put_meta(conn, meta)
+        conn.execute("COMMIT")
+
+        video_unique_count = conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
 
-    agg["videos_by_bvid"] = videos_by_bvid
-    agg["meta"]["video_unique_count"] = len(videos_by_bvid)
-    agg["meta"]["capture_record_count"] = agg["meta"].get("capture_record_count", 0) + added_records
+    return {
+        "source": meta["source"],
+        "created_ts": meta["created_ts"],
+        "last_update_ts": meta["last_update_ts"],
+        "meta": {
+            "video_unique_count": video_unique_count,
+            "capture_record_count": meta["capture_record_count"],
+        },
+    }
+
+def load_aggregate_history(db_path: str = AGG_DB_PATH) -> Dict[str, Any]:
+    """
+    从 SQLite 导出旧版 region_history.json 的完整嵌套结构（videos_by_bvid[bvid]["captures"][key]）
+    capture key 按插入顺序用 _unique_capture_key 分配
+    """
+    if not os.path.exists(db_path):
+        return _new_agg_index(None)
 
-    save_json(agg_path, agg)
+    conn = open_agg_db(db_path)
+    try:
+        meta = _get_meta(conn)
+        agg = _new_agg_index(meta.get("created_ts"))
+        agg["source"] = meta.get("source") or agg["source"]
+        agg["last_update_ts"] = meta.get("last_update_ts")
+
+        videos_by_bvid: Dict[str, Any] = agg["videos_by_bvid"]
+        for bvid, js in conn.execute("SELECT bvid, json FROM videos"):
+            node = orjson.loads(js)
+            node.pop("captures_count", None)
+            node.pop("last_capture_ts", None)
+            node["captures"] = {}
+            videos_by_bvid[bvid] = node
+
+        for bvid, ts, run_id, payload in conn.execute(
+            "SELECT bvid, capture_ts, run_id, payload FROM captures ORDER BY id"
+        ):
+            node = videos_by_bvid.get(bvid)
+            if node is None:
+                continue
+            captures = node["captures"]
+            key = _unique_capture_key(int(ts or 0), str(run_id), captures)
+            captures[key] = orjson.loads(payload)
+    finally:
+        conn.close()
+
+    agg["meta"]["video_unique_count"] = len(videos_by_bvid)
+    agg["meta"]["capture_record_count"] = meta.get("capture_record_count", 0)
     return agg
 
+def export_aggregate_json(out_path: str = AGG_EXPORT_PATH) -> str:
+    """兼容旧版消费方：把 SQLite 聚合导出成一份 region_history 结构的 JSON"""
+    save_json(out_path, load_aggregate_history(), pretty=False)
+    return out_path
+
 
 # ================== daily：每天一个文件，按时间戳分类（模仿你 popular 的 captures 归档思路） ==================
-def update_daily_file(run_doc: Dict[str, Any], daily_dir: str = DAILY_DIR) -> Dict[str, Any]:
+def update_daily_file(
+    run_doc: Dict[str, Any],
+    videos: Optional[Iterable[Dict[str, Any]]] = None,
+    daily_dir: str = DAILY_DIR,
+) -> Dict[str, Any]:
     """
     daily/Neg/YYYY-MM-DD.json
       captures[<capture_ts_key>] = { run info + meta + category_stats + videos(list) }
+    videos 为 dict 的可迭代对象（如 iter_run_videos）；默认取 run_doc["videos"]（VideoRecord 经 iter_doc_videos 转成 dict）
     """
     date = run_doc.get("date") or today_str(int(run_doc.get("capture_ts") or now_ts()))
     daily_path = os.path.join(daily_dir, f"{date}.json")
@@ -452,38 +879,101 @@ def update_daily_file(run_doc: Dict[str, Any], daily_dir: str = DAILY_DIR) -> Di
         "meta": run_doc.get("meta", {}),
         "count": run_doc.get("count", 0),
         "category_stats": run_doc.get("category_stats", {}),
-        "videos": run_doc.get("videos", []),
+        "videos": list(iter_doc_videos(run_doc) if videos is None else videos),
     }
 
     daily["captures"] = captures
     daily["last_update_ts"] = capture_ts
-    daily["meta"]["capture_count"] = len(captures)
-
-    # total_video_records = sum(每次 capture 的 count)
-    total_records = 0
-    for _, c in captures.items():
-        if isinstance(c, dict) and isinstance(c.get("count"), int):
-            total_records += int(c.get("count"))
-    daily["meta"]["total_video_records"] = total_records
+    meta = daily.setdefault("meta", {})
+    meta["capture_count"] = len(captures)
+
+    # total_video_records = sum(每次 capture 的 count)：累加本次 count，不再扫描全部 captures
+    # 旧文件缺这个字段时（一次性）按原逻辑全量重算
+    count = run_doc.get("count", 0)
+    if isinstance(meta.get("total_video_records"), int):
+        meta["total_video_records"] += count if isinstance(count, int) else 0
+    else:
+        meta["total_video_records"] = sum(
+            c["count"] for c in captures.values() if isinstance(c, dict) and isinstance(c.get("count"), int)
+        )
 
-    save_json(daily_path, daily)
+    save_json(daily_path, daily, pretty=False)
     return daily
 
 
+# ================== 抓取：单个 rid 的翻页（在 rid 线程池中执行） ==================
+def crawl_one_rid(
+    page_pool: ThreadPoolExecutor,
+    rid: int,
+    date: str,
+    run_id: str,
+    capture_ts: int,
+) -> Tuple[List[VideoRecord], int]:
+    """返回 (本 rid 的 VideoRecord, 成功抓取的页数)；raw 在本线程落盘（每页一个文件，互不冲突）"""
+    rid_videos: List[VideoRecord] = []
+    rid_collected = 0
+    pages = 0
+    for pn, raw, raw_bytes, err in iter_rid_pages(page_pool, rid):
+        if isinstance(err, requests.HTTPError):
+            # 1️⃣ HTTP 层面的 404 / 5xx
+            status = getattr(err.response, "status_code", None)
+            if status == 404:
+                #print(f"[WARN] rid={rid} pn={pn} HTTP 404, skip this rid.")
+                break
+            #print(f"[WARN] rid={rid} pn={pn} HTTP error={status}, skip this page.")
+            continue
+        if err is not None:
+            # 2️⃣ code != 0 或其他异常
+            #print(f"[WARN] rid={rid} pn={pn} error: {err}, skip this rid.")
+            break
+
+        # ✅ 每页 raw 单独保存（不覆盖）：直接写响应 bytes，gzip 压缩
+        raw_path = os.path.join(RAW_DIR, f"{date}__run_{run_id}__rid{rid}__pn{pn}__ps{PS}.json.gz")
+        write_gzip_bytes(raw_path, raw_bytes)
+
+        data = raw.get("data") or {}
+        archives = data.get("archives") or []
+
+        # ✅ 空则停止该 rid 的分页
+        if not archives:
+            print(f"[INFO] rid={rid} pn={pn} empty, stop this rid.")
+            break
+
+        # 规范化（把 request_rid 写进去）
+        rid_videos.extend(normalize_dynamic_archives(archives, capture_ts=capture_ts, request_rid=rid))
+
+        rid_collected += len(archives)
+        pages += 1
+
+    print(f"[INFO] rid={rid} pages_fetched~ collected_items={rid_collected}")
+    return rid_videos, pages
+
+
 # ================== 主流程：每次 run 独立 + 更新聚合总文件 + 更新 daily 单文件 ==================
 def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--export-agg", nargs="?", const=AGG_EXPORT_PATH, default=None, metavar="PATH",
+        help=f"export the sqlite aggregate as region_history JSON and exit (default: {AGG_EXPORT_PATH})",
+    )
+    args = ap.parse_args()
+
     ensure_dirs()
+    if args.export_agg:
+        print(f"[OK] agg export -> {export_aggregate_json(args.export_agg)}")
+        return
 
-    ts = now_ts()
+    run_t = time.time()
+    ts = int(run_t)
     date = today_str(ts)
-    run_id = datetime_compact(ts)
+    run_id = datetime_compact(run_t)
 
     run_path = os.path.join(
         RUN_DIR,
-        f"{date}__run_{run_id}__rids{len(RID_LIST)}__pn{PN_MAX}__ps{PS}__obs{OBS_HOURS}h.json",
+        f"{date}__run_{run_id}__rids{len(RID_LIST)}__pn{PN_MAX}__ps{PS}__obs{OBS_HOURS}h.jsonl",
     )
 
-    # ✅ processed run 结构：完全模仿 popular run 文件
+    # ✅ processed run 结构：完全模仿 popular run 文件（videos 逐行写出，统计写在最后的 summary 行）
     doc: Dict[str, Any] = {
         "date": date,
         "capture_ts": ts,
@@ -500,76 +990,53 @@ def main() -> None:
                 "obs_hours": OBS_HOURS,
             }
         ],
-        "videos": [],
-        "meta": {"pos_count": 0, "neg_count": 0, "total_count": 0},
-        "count": 0,
-        "category_stats": {},
     }
 
     pages_fetched = 0
-    all_videos: List[Dict[str, Any]] = []
+    stats = RunStats()
 
-    s = build_session()
+    # 1) 保存本次 run processed（不覆盖）：rid 按 RID_LIST 顺序写出，结果与串行版本一致
+    # 不用 rid_pool.map（会一次提交全部 rid，排在前面的 rid 慢时后面的结果全堆在内存里）：
+    # 最多 RID_WORKERS 个 rid 在途，最早的写出后再提交下一个
     try:
-        for rid in RID_LIST:
-            rid_collected = 0
-            for pn in range(1, PN_MAX + 1):
-                try:
-                    raw = fetch_dynamic_region_page(s, rid=rid, pn=pn, ps=PS)
-                except requests.HTTPError as e:
-                    # 1️⃣ HTTP 层面的 404 / 5xx
-                    status = getattr(e.response, "status_code", None)
-                    if status == 404:
-                        #print(f"[WARN] rid={rid} pn={pn} HTTP 404, skip this rid.")
-                        break
-                    #print(f"[WARN] rid={rid} pn={pn} HTTP error={status}, skip this page.")
-                    continue
-                except Exception as e:
-                    # 2️⃣ code != 0 或其他异常
-                    #print(f"[WARN] rid={rid} pn={pn} error: {e}, skip this rid.")
-                    break
-
-                # ✅ 每页 raw 单独保存（不覆盖）
-                raw_path = os.path.join(RAW_DIR, f"{date}__run_{run_id}__rid{rid}__pn{pn}__ps{PS}.json")
-                save_json(raw_path, raw)
-
-                data = raw.get("data") or {}
-                archives = data.get("archives") or []
-
-                # ✅ 空则停止该 rid 的分页
-                if not archives:
-                    print(f"[INFO] rid={rid} pn={pn} empty, stop this rid.")
-                    break
-
-                # 规范化（把 request_rid 写进去）
-                videos = normalize_dynamic_archives(archives, capture_ts=ts, request_rid=rid)
-                all_videos.extend(videos)
-
-                rid_collected += len(archives)
-                pages_fetched += 1
-                time.sleep(SLEEP_BETWEEN_PAGES)
-
-            print(f"[INFO] rid={rid} pages_fetched~ collected_items={rid_collected}")
+        with open(run_path, "wb") as run_f, \
+                ThreadPoolExecutor(max_workers=PAGE_WORKERS) as page_pool, \
+                ThreadPoolExecutor(max_workers=RID_WORKERS) as rid_pool:
+            run_f.write(orjson.dumps({"header": doc}, option=_OPT_NDJSON))
+            rids = iter(RID_LIST)
+            in_flight = deque(
+                rid_pool.submit(crawl_one_rid, page_pool, rid, date=date, run_id=run_id, capture_ts=ts)
+                for rid in islice(rids, RID_WORKERS)
+            )
+            while in_flight:
+                videos, pages = in_flight.popleft().result()
+                rid = next(rids, None)
+                if rid is not None:
+                    in_flight.append(
+                        rid_pool.submit(crawl_one_rid, page_pool, rid, date=date, run_id=run_id, capture_ts=ts)
+                    )
+                run_f.write(b"".join([orjson.dumps(v, option=_OPT_NDJSON) for v in videos]))
+                for v in videos:
+                    stats.add(v)
+                pages_fetched += pages
+
+            summary = stats.apply({})
+            run_f.write(orjson.dumps({"summary": summary}, option=_OPT_NDJSON))
+            doc.update(summary)
     finally:
-        s.close()
-
-    doc["videos"] = all_videos
-    doc = recompute_run_fields(doc)
-
-    # 1) 保存本次 run processed（不覆盖）
-    save_json(run_path, doc)
+        close_thread_sessions()
 
-    # 2) 更新历史聚合（按 bvid / captures）
-    agg = update_aggregate_history(doc, AGG_PATH)
+    # 2) 更新历史聚合（按 bvid / captures）：从 run 文件流式读回
+    agg = update_aggregate_history(doc, iter_run_videos(run_path))
 
     # 3) 更新 daily 单文件（按 capture_ts 分类）
-    daily = update_daily_file(doc, DAILY_DIR)
+    daily = update_daily_file(doc, iter_run_videos(run_path), DAILY_DIR)
 
     print(
         f"[OK] date={date} run_id={run_id} rids={len(RID_LIST)} pages={pages_fetched} "
-        f"videos={len(all_videos)} -> {run_path}"
+        f"videos={stats.count} -> {run_path}"
     )
-    print(f"[OK] agg -> {AGG_PATH} (unique_videos={agg['meta']['video_unique_count']})")
+    print(f"[OK] agg -> {AGG_DB_PATH} (unique_videos={agg['meta']['video_unique_count']})")
     print(f"[OK] daily -> {os.path.join(DAILY_DIR, date + '.json')} (capture_count={daily['meta']['capture_count']})")
 
 
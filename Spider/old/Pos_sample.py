@@ -17,13 +17,13 @@ JSON-only Week2 - Step1: 抓热门(popular) 多页 + 去重 + 合并写入当日
   PS = 50
 """
 
-import json
-import copy
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import orjson  # 硬依赖（requirements.txt），与其它脚本一致，不回退标准库 json
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -39,7 +39,13 @@ DAILY_DIR = os.path.join(DATA_DIR, "daily")
 TIMEOUT = 30
 PN_MAX = 100
 PS = 50
-SLEEP_BETWEEN_PAGES = 0.2
+SLEEP_BETWEEN_PAGES = 0.2  # 每轮（PAGE_WINDOW 页）之间的间隔
+
+# 并发窗口：每轮同时请求的页数（遇到空页即停止派发下一轮）；不超过 HTTPAdapter 默认连接池 10
+PAGE_WINDOW = 4
+
+# orjson 输出：缩进 2，中文原样写出（等价于 json.dump(ensure_ascii=False, indent=2)）
+_OPT_PRETTY = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
 
 # ================== 工具函数 ==================
 def ensure_dirs() -> None:
@@ -56,10 +62,24 @@ def datetime_compact(ts: int) -> str:
     # 带毫秒，降低同秒重复运行导致 raw 覆盖的风险
     return datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H-%M-%S") + f".{int((time.time() % 1) * 1000):03d}"
 
+def write_bytes(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+def atomic_write_json(path: str, obj: Any, durable: bool = True) -> None:
+    # 先写 tmp（整份 bytes 一次 write）并 fsync，再 rename：中途崩溃/断电都不会留下半截 json
+    # durable=False：只保留 tmp + rename 的原子性、跳过 fsync（逐页 raw 备份这类可丢的文件用）
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(obj, option=_OPT_PRETTY))
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 def safe_div(a: Optional[float], b: Optional[float]) -> Optional[float]:
-    if a is None or b in (None, 0):
-        return None
-    return a / b
+    # b 为 None / 0 时无意义
+    return a / b if a is not None and b else None
 
 # ================== 网络 ==================
 def build_session() -> requests.Session:
@@ -77,80 +97,83 @@ def build_session() -> requests.Session:
     s.mount("https://", adapter)
     return s
 
-def fetch_popular_page(session: requests.Session, pn: int = 1, ps: int = 20) -> Dict[str, Any]:
+def fetch_popular_page(
+    session: requests.Session, pn: int = 1, ps: int = 20
+) -> Tuple[Dict[str, Any], bytes]:
+    """返回 (解析后的 dict, 响应原始 bytes)；raw 落盘直接写 bytes，不再重新序列化"""
+    # 走 session.get：每次请求都合并 session 上的 cookie（如 buvid3）与环境代理/CA 设置
     resp = session.get(POPULAR_API, params={"pn": pn, "ps": ps}, timeout=TIMEOUT)
-    data = resp.json()
+    # 直接从响应 bytes 解析，跳过 requests 的编码探测与 str 解码
+    raw_bytes = resp.content
+    data = orjson.loads(raw_bytes)
     if not isinstance(data, dict):
         raise RuntimeError(f"popular response not dict (pn={pn}, ps={ps})")
     if data.get("code") != 0:
         raise RuntimeError(f"popular error pn={pn} ps={ps}: code={data.get('code')} msg={data.get('message')}")
-    return data
+    return data, raw_bytes
 
 # ================== 规范化/合并 ==================
 def normalize_popular_items(items: List[Dict[str, Any]], capture_ts: int) -> List[Dict[str, Any]]:
     videos: List[Dict[str, Any]] = []
     for item in items:
-        stat = item.get("stat") or {}
-        owner = item.get("owner") or {}
+        # 每条 item 只取一次 .get 绑定方法，后面十几次字段读取都走局部变量
+        get = item.get
+        stat_get = (get("stat") or {}).get
+        owner_get = (get("owner") or {}).get
 
-        pubdate = item.get("pubdate")
+        pubdate = get("pubdate")
         age_hours = (capture_ts - pubdate) / 3600 if pubdate else None
 
-        view = stat.get("view", 0)
+        # stat 每个字段只取一次，snap 与 features 共用；
+        # 比率直接内联计算（同 safe_div：分子为 None 或分母为 None/0 时为 None）
+        view = stat_get("view", 0)
+        like = stat_get("like")
+        coin = stat_get("coin")
+        favorite = stat_get("favorite")
 
         features_as_of_capture = {
-            "like_rate": safe_div(stat.get("like"), view),
-            "coin_rate": safe_div(stat.get("coin"), view),
-            "favorite_rate": safe_div(stat.get("favorite"), view),
-            "view_per_hour": safe_div(view, age_hours) if age_hours and age_hours > 0 else None,
+            "like_rate": (like / view) if like is not None and view else None,
+            "coin_rate": (coin / view) if coin is not None and view else None,
+            "favorite_rate": (favorite / view) if favorite is not None and view else None,
+            "view_per_hour": (view / age_hours) if view is not None and age_hours and age_hours > 0 else None,
             "age_hours": age_hours,
         }
 
-        bvid = item.get("bvid")
+        snap = {
+            "ts": capture_ts,
+            "view": stat_get("view"),
+            "like": like,
+            "coin": coin,
+            "favorite": favorite,
+            "reply": stat_get("reply"),
+            "danmaku": stat_get("danmaku"),
+            "share": stat_get("share"),
+        }
+
+        bvid = get("bvid")
         videos.append(
             {
                 "bvid": bvid,
-                "aid": item.get("aid"),
+                "aid": get("aid"),
                 "label": 1,
 
-                "title": item.get("title"),
-                "url": item.get("short_link_v2") or (f"https://b23.tv/{bvid}" if bvid else None),
+                "title": get("title"),
+                "url": get("short_link_v2") or (f"https://b23.tv/{bvid}" if bvid else None),
 
-                "tid": item.get("tid"),
-                "tname": item.get("tname"),
+                "tid": get("tid"),
+                "tname": get("tname"),
                 "pubdate": pubdate,
                 "first_seen_ts": capture_ts,
 
                 "up": {
-                    "mid": owner.get("mid"),
-                    "name": owner.get("name"),
-                    "follower": owner.get("follower"),
+                    "mid": owner_get("mid"),
+                    "name": owner_get("name"),
+                    "follower": owner_get("follower"),
                 },
 
-                # 快照（抓取这一刻）
-                "snapshots": {
-                    "as_of_capture": {
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                    # 兼容旧字段名（不要再把它理解成“发布后0小时”）
-                    "0h": {
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                },
+                # 快照（抓取这一刻）；0h 为兼容旧字段名（不要再把它理解成“发布后0小时”），
+                # 与 as_of_capture 有意共享同一个 dict（两个键的内容总是相同，不会单独修改）
+                "snapshots": {"as_of_capture": snap, "0h": snap},
                 "features": {
                     "as_of_capture": features_as_of_capture,
                     # 兼容旧字段名
@@ -161,48 +184,80 @@ def normalize_popular_items(items: List[Dict[str, Any]], capture_ts: int) -> Lis
     return videos
 
 def dedup_by_bvid(videos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    seen = set()
-    out = []
+    # 同一 bvid 保留第一次出现的那条；dict 保持插入顺序，setdefault 一次完成“查 + 插”
+    first: Dict[str, Dict[str, Any]] = {}
+    setdefault = first.setdefault
     for v in videos:
         bvid = v.get("bvid")
-        if not bvid or bvid in seen:
-            continue
-        seen.add(bvid)
-        out.append(v)
-    return out
+        if bvid:
+            setdefault(bvid, v)
+    return list(first.values())
 
 def load_daily_if_exists(path: str) -> Dict[str, Any]:
     if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     return {}
 
+def _clone(o: Any) -> Any:
+    """video 里只有 JSON 原生类型（dict/list/标量），按类型分派逐层复制即可；
+    不需要 copy.deepcopy 的 memo 表与循环引用检测"""
+    t = type(o)
+    if t is dict:
+        return {k: _clone(v) for k, v in o.items()}
+    if t is list:
+        return [_clone(v) for v in o]
+    return o
+
 def _deep_merge_dict(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
-    """浅层优先合并：dict 递归合并；非 dict 以 src 覆盖 dst。"""
-    for k, v in (src or {}).items():
-        if isinstance(v, dict) and isinstance(dst.get(k), dict):
-            _deep_merge_dict(dst[k], v)
-        else:
-            dst[k] = v
+    """浅层优先合并：dict 递归合并；非 dict 以 src 覆盖 dst。
+
+    用显式栈代替递归（省掉每层一次函数调用）；JSON 出来的只有精确的 dict，用 type() is 判断即可
+    """
+    if not src:
+        return dst
+    stack = [(dst, src)]
+    while stack:
+        d, s = stack.pop()
+        d_get = d.get
+        for k, v in s.items():
+            dv = d_get(k)
+            if type(v) is dict and type(dv) is dict:
+                stack.append((dv, v))
+            else:
+                d[k] = v
     return dst
 
 
-def merge_videos_by_bvid(existing: List[Dict[str, Any]], incoming: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """以 bvid 为唯一主键合并。
+def merge_videos_by_bvid(
+    existing: List[Dict[str, Any]], incoming: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], int, int]:
+    """以 bvid 为唯一主键合并，返回 (合并后的 videos, pos_count, neg_count)。
 
     规则：
     - 同 bvid 冲突时：label=1 覆盖 label=0
     - first_seen_ts 取更早的
     - snapshots/features 做字典合并（尽量不丢历史）
+    pos/neg 计数在 put 里随插入/label 变化同步维护，调用方不用再扫一遍
     """
     out: Dict[str, Dict[str, Any]] = {}
+    pos = 0
+    neg = 0
+
+    def tally(label: Any, d: int) -> None:
+        nonlocal pos, neg
+        if label == 1:
+            pos += d
+        elif label == 0:
+            neg += d
 
     def put(v: Dict[str, Any]) -> None:
         bvid = v.get("bvid")
         if not bvid:
             return
         if bvid not in out:
-            out[bvid] = copy.deepcopy(v)
+            out[bvid] = _clone(v)
+            tally(v.get("label"), 1)
             return
 
         cur = out[bvid]
@@ -215,7 +270,7 @@ def merge_videos_by_bvid(existing: List[Dict[str, Any]], incoming: List[Dict[str
 
         if label_rank(new_label) >= label_rank(cur_label):
             # 用新记录覆盖基础字段（保留快照/特征合并）
-            base = copy.deepcopy(v)
+            base = _clone(v)
             # 先拿当前快照/特征
             base_snap = cur.get("snapshots") or {}
             base_feat = cur.get("features") or {}
@@ -243,6 +298,11 @@ def merge_videos_by_bvid(existing: List[Dict[str, Any]], incoming: List[Dict[str
         if cur.get("label") != 1 and v.get("label") == 1:
             cur["label"] = 1
 
+        label = cur.get("label")
+        if label != cur_label:
+            tally(cur_label, -1)
+            tally(label, 1)
+
         out[bvid] = cur
 
     for v in existing or []:
@@ -250,35 +310,49 @@ def merge_videos_by_bvid(existing: List[Dict[str, Any]], incoming: List[Dict[str
     for v in incoming or []:
         put(v)
 
-    return list(out.values())
+    return list(out.values()), pos, neg
 
 
 def merge_daily_pos(existing_daily: Dict[str, Any], new_pos: List[Dict[str, Any]]) -> Dict[str, Any]:
     old_videos = existing_daily.get("videos", []) or []
-    merged_all = merge_videos_by_bvid(old_videos, new_pos)
+    merged_all, pos, neg = merge_videos_by_bvid(old_videos, new_pos)
 
     existing_daily.setdefault("meta", {})
     existing_daily["videos"] = merged_all
-    existing_daily["meta"]["pos_count"] = len([v for v in merged_all if v.get("label") == 1])
-    existing_daily["meta"]["neg_count"] = len([v for v in merged_all if v.get("label") == 0])
+    existing_daily["meta"]["pos_count"] = pos
+    existing_daily["meta"]["neg_count"] = neg
     existing_daily["meta"]["total_count"] = len(merged_all)
     return existing_daily
 
+class _CatAgg:
+    """单个 tid 的分区统计中间量（slots 属性，比每次按 key 读写 dict 更省）"""
+    __slots__ = ("tname", "video_count", "view_sum", "view_cnt", "like_rate_sum", "like_rate_cnt")
+
+    def __init__(self, tname: Any) -> None:
+        self.tname = tname
+        self.video_count = 0
+        self.view_sum = 0
+        self.view_cnt = 0
+        self.like_rate_sum = 0.0
+        self.like_rate_cnt = 0
+
 def recompute_daily_fields(daily: Dict[str, Any]) -> Dict[str, Any]:
     videos = daily.get("videos", []) or []
 
     # 1) count
     daily["count"] = len(videos)
 
-    # 2) meta（可一起兜底）
-    daily.setdefault("meta", {})
-    daily["meta"]["pos_count"] = len([v for v in videos if v.get("label") == 1])
-    daily["meta"]["neg_count"] = len([v for v in videos if v.get("label") == 0])
-    daily["meta"]["total_count"] = len(videos)
-
-    # 3) category_stats：按 tid 聚合（只统计正样本/或全部都行，这里用全部）
-    cat = {}
+    # 2) meta 计数 + 3) category_stats 按 tid 聚合（统计全部视频）：单次遍历一起做
+    pos = 0
+    neg = 0
+    cat: Dict[str, _CatAgg] = {}
     for v in videos:
+        label = v.get("label")
+        if label == 1:
+            pos += 1
+        elif label == 0:
+            neg += 1
+
         tid = v.get("tid")
         if tid is None:
             continue
@@ -293,35 +367,36 @@ def recompute_daily_fields(daily: Dict[str, Any]) -> Dict[str, Any]:
         feat = feats.get("as_of_capture") or feats.get("0h") or {}
         like_rate_as_of = feat.get("like_rate")
 
-        if tid not in cat:
-            cat[tid] = {
-                "tname": tname,
-                "video_count": 0,
-                "view_sum": 0,
-                "view_cnt": 0,
-                "like_rate_sum": 0.0,
-                "like_rate_cnt": 0,
-            }
+        entry = cat.get(tid)
+        if entry is None:
+            entry = cat[tid] = _CatAgg(tname)
 
-        cat[tid]["video_count"] += 1
+        entry.video_count += 1
 
         if isinstance(view_as_of, (int, float)):
-            cat[tid]["view_sum"] += view_as_of
-            cat[tid]["view_cnt"] += 1
+            entry.view_sum += view_as_of
+            entry.view_cnt += 1
 
         if isinstance(like_rate_as_of, (int, float)):
-            cat[tid]["like_rate_sum"] += like_rate_as_of
-            cat[tid]["like_rate_cnt"] += 1
+            entry.like_rate_sum += like_rate_as_of
+            entry.like_rate_cnt += 1
+
+    # meta（可一起兜底）
+    daily.setdefault("meta", {})
+    daily["meta"]["pos_count"] = pos
+    daily["meta"]["neg_count"] = neg
+    daily["meta"]["total_count"] = len(videos)
 
     # 输出时把中间变量变成最终统计
-    out = {}
-    for tid, s in cat.items():
-        out[tid] = {
-            "tname": s["tname"],
-            "video_count": s["video_count"],
-            "avg_view_0h": (s["view_sum"] / s["view_cnt"]) if s["view_cnt"] > 0 else None,
-            "avg_like_rate_0h": (s["like_rate_sum"] / s["like_rate_cnt"]) if s["like_rate_cnt"] > 0 else None,
+    out: Dict[str, Dict[str, Any]] = {
+        tid: {
+            "tname": e.tname,
+            "video_count": e.video_count,
+            "avg_view_0h": (e.view_sum / e.view_cnt) if e.view_cnt > 0 else None,
+            "avg_like_rate_0h": (e.like_rate_sum / e.like_rate_cnt) if e.like_rate_cnt > 0 else None,
         }
+        for tid, e in cat.items()
+    }
 
     daily["category_stats"] = out
     return daily
@@ -349,23 +424,31 @@ def main(pn_max: int = PN_MAX, ps: int = PS) -> None:
 
     s = build_session()
     try:
-        for pn in range(1, pn_max + 1):
-            raw = fetch_popular_page(s, pn=pn, ps=ps)
-
-            items = raw.get("data", {}).get("list", [])
-
-            # ⭐ 关键防御：如果本页已经没有数据，直接停止分页
-            if not items:
-                print(f"[INFO] pn={pn} returned empty list, stop pagination.")
-                break
-
-            # 只有在有数据时才备份 raw
-            raw_path = os.path.join(RAW_DIR, f"{datetime_compact(ts)}_pn{pn}_ps{ps}.json")
-            with open(raw_path, "w", encoding="utf-8") as f:
-                json.dump(raw, f, ensure_ascii=False, indent=2)
-
-            all_items.extend(items)
-            time.sleep(SLEEP_BETWEEN_PAGES)
+        with ThreadPoolExecutor(max_workers=PAGE_WINDOW) as pool:
+            stop = False
+            for start in range(1, pn_max + 1, PAGE_WINDOW):
+                pns = range(start, min(start + PAGE_WINDOW, pn_max + 1))
+                raws = pool.map(lambda pn: fetch_popular_page(s, pn=pn, ps=ps), pns)
+
+                # 按 pn 顺序处理，保证与串行版本结果一致
+                for pn, (raw, raw_bytes) in zip(pns, raws):
+                    items = raw.get("data", {}).get("list", [])
+
+                    # ⭐ 关键防御：如果本页已经没有数据，直接停止分页（同一轮后面的页丢弃）
+                    if not items:
+                        print(f"[INFO] pn={pn} returned empty list, stop pagination.")
+                        stop = True
+                        break
+
+                    # 只有在有数据时才备份 raw
+                    raw_path = os.path.join(RAW_DIR, f"{datetime_compact(ts)}_pn{pn}_ps{ps}.json")
+                    write_bytes(raw_path, raw_bytes)
+
+                    all_items.extend(items)
+
+                if stop:
+                    break
+                time.sleep(SLEEP_BETWEEN_PAGES)
     finally:
         s.close()
 
@@ -374,8 +457,7 @@ def main(pn_max: int = PN_MAX, ps: int = PS) -> None:
 
     daily = merge_daily_pos(daily, new_pos)
     daily = recompute_daily_fields(daily)
-    with open(daily_path, "w", encoding="utf-8") as f:
-        json.dump(daily, f, ensure_ascii=False, indent=2)
+    atomic_write_json(daily_path, daily)
 
     print(f"[OK] date={date} pn_max={pn_max} ps={ps} items={len(all_items)} pos_added={len(new_pos)} merged_total={daily.get('meta', {}).get('total_count')}")
     print(f"[OK] daily -> {daily_path}")
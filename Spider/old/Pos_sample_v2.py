@@ -7,9 +7,15 @@ JSON-only Week2 (No-merge per-run) + Aggregate history by bvid
 - data/runs/popular/          每次运行 processed 文件（不合并、不覆盖）
 
 新增：
-- data/agg/popular_history.json
-  把历史所有 run 的视频数据聚合到同一个文件里，但按 bvid 归档：
+- 按 bvid 聚合历史所有 run 的视频数据：
   videos[bvid].captures[<capture_ts>] = 本次抓到的快照/特征/关键信息
+  - data/agg/popular_history.ndjson：每次抓取追加一行（append-only，不再整份重写）
+  - data/agg/popular_history_index.json：只存每个 bvid 的固定字段 + latest_capture_ts / captures_count
+    + last_offset（该 bvid 最新一行在 NDJSON 里的字节偏移，行内 prev 指向上一条）；
+    index 的 captures_size 记录已并入 index 的 NDJSON 字节数：NDJSON 先 fsync 再写 index，
+    两者之间崩溃留下的尾部行下次运行时补进 index
+  - load_video_captures(bvid) 用 mmap 按偏移只读单个 bvid 的历史
+  - load_aggregate_history() 可还原成旧版 popular_history.json 的嵌套结构
 
 用法：
   python popular_run_crawler.py
@@ -19,12 +25,14 @@ JSON-only Week2 (No-merge per-run) + Aggregate history by bvid
   PS = 50
 """
 
-import json
+import mmap
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -38,12 +46,22 @@ DATA_DIR = "data"
 RAW_DIR = os.path.join(DATA_DIR, "raw", "popular")
 RUN_DIR = os.path.join(DATA_DIR, "daily", "Pos")     # 每次运行的 processed 输出目录
 AGG_DIR = os.path.join(DATA_DIR, "agg")                 # 聚合输出目录（新）
-AGG_PATH = os.path.join(AGG_DIR, "popular_history.json")
+AGG_PATH = os.path.join(AGG_DIR, "popular_history.json")  # 旧版整份聚合文件（仅用于一次性迁移）
+AGG_CAPTURES_PATH = os.path.join(AGG_DIR, "popular_history.ndjson")
+AGG_INDEX_PATH = os.path.join(AGG_DIR, "popular_history_index.json")
 
 TIMEOUT = 30
 PN_MAX = 100
 PS = 50
-SLEEP_BETWEEN_PAGES = 0.2
+SLEEP_BETWEEN_PAGES = 0.2  # 每轮（PAGE_WINDOW 页）之间的间隔
+
+# 并发窗口：每轮同时请求的页数（遇到空页即停止派发下一轮）；不超过 HTTPAdapter 默认连接池 10
+PAGE_WINDOW = 4
+
+# orjson 输出，中文原样写出：紧凑（程序读的文件）/ 缩进 2（等价于 json.dump(ensure_ascii=False, indent=2)）
+_OPT_COMPACT = orjson.OPT_NON_STR_KEYS
+_OPT_PRETTY = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+_OPT_NDJSON = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
 
 
 # ================== 工具函数 ==================
@@ -62,20 +80,24 @@ def datetime_compact(ts: int) -> str:
     # 带毫秒，避免同秒覆盖
     return datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H-%M-%S") + f".{int((time.time() % 1) * 1000):03d}"
 
-def safe_div(a: Optional[float], b: Optional[float]) -> Optional[float]:
-    if a is None or b in (None, 0):
-        return None
-    return a / b
-
 def load_json_if_exists(path: str) -> Optional[Dict[str, Any]]:
     if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     return None
 
-def save_json(path: str, obj: Dict[str, Any]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+def atomic_write_json(path: str, obj: Dict[str, Any], pretty: bool = False) -> None:
+    # 先写 tmp（整份 bytes 一次 write）并 fsync，再 rename：中途崩溃/断电都不会留下半截 json
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(obj, option=_OPT_PRETTY if pretty else _OPT_COMPACT))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def write_bytes(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
 
 
 # ================== 网络 ==================
@@ -94,14 +116,20 @@ def build_session() -> requests.Session:
     s.mount("https://", adapter)
     return s
 
-def fetch_popular_page(session: requests.Session, pn: int = 1, ps: int = 20) -> Dict[str, Any]:
+def fetch_popular_page(
+    session: requests.Session, pn: int = 1, ps: int = 20
+) -> Tuple[Dict[str, Any], bytes]:
+    """返回 (解析后的 dict, 响应原始 bytes)；raw 落盘直接写 bytes，不再重新序列化"""
+    # 走 session.get：每次请求都合并 session 上的 cookie（如 buvid3）与环境代理/CA 设置
     resp = session.get(POPULAR_API, params={"pn": pn, "ps": ps}, timeout=TIMEOUT)
-    data = resp.json()
+    # 直接从响应 bytes 解析，跳过 requests 的编码探测与 str 解码
+    raw_bytes = resp.content
+    data = orjson.loads(raw_bytes)
     if not isinstance(data, dict):
         raise RuntimeError(f"popular response not dict (pn={pn}, ps={ps})")
     if data.get("code") != 0:
         raise RuntimeError(f"popular error pn={pn} ps={ps}: code={data.get('code')} msg={data.get('message')}")
-    return data
+    return data, raw_bytes
 
 
 # ================== 规范化 ==================
@@ -113,66 +141,65 @@ def normalize_popular_items(items: List[Dict[str, Any]], capture_ts: int) -> Lis
     """
     videos: List[Dict[str, Any]] = []
     for item in items:
-        stat = item.get("stat") or {}
-        owner = item.get("owner") or {}
+        # 每条 item 只取一次 .get 绑定方法，后面十几次字段读取都走局部变量
+        get = item.get
+        stat_get = (get("stat") or {}).get
+        owner_get = (get("owner") or {}).get
 
-        pubdate = item.get("pubdate")
+        pubdate = get("pubdate")
         age_hours = (capture_ts - pubdate) / 3600 if pubdate else None
 
-        view = stat.get("view", 0)
+        # stat 每个字段只取一次，snap 与 features 共用；
+        # 比率直接内联计算（分子为 None 或分母为 None/0 时为 None）
+        view = stat_get("view", 0)
+        like = stat_get("like")
+        coin = stat_get("coin")
+        favorite = stat_get("favorite")
 
         features_as_of_capture = {
-            "like_rate": safe_div(stat.get("like"), view),
-            "coin_rate": safe_div(stat.get("coin"), view),
-            "favorite_rate": safe_div(stat.get("favorite"), view),
-            "view_per_hour": safe_div(view, age_hours) if age_hours and age_hours > 0 else None,
+            "like_rate": (like / view) if like is not None and view else None,
+            "coin_rate": (coin / view) if coin is not None and view else None,
+            "favorite_rate": (favorite / view) if favorite is not None and view else None,
+            "view_per_hour": (view / age_hours) if view is not None and age_hours and age_hours > 0 else None,
             "age_hours": age_hours,
         }
 
-        bvid = item.get("bvid")
+        snap = {
+            "ts": capture_ts,
+            "view": stat_get("view"),
+            "like": like,
+            "coin": coin,
+            "favorite": favorite,
+            "reply": stat_get("reply"),
+            "danmaku": stat_get("danmaku"),
+            "share": stat_get("share"),
+        }
+
+        bvid = get("bvid")
         videos.append(
             {
                 "bvid": bvid,
-                "aid": item.get("aid"),
+                "aid": get("aid"),
                 "label": 1,
 
                 "capture_ts": capture_ts,  # ✅ 本条视频的抓取时间戳（秒）
-                "title": item.get("title"),
-                "url": item.get("short_link_v2") or (f"https://b23.tv/{bvid}" if bvid else None),
+                "title": get("title"),
+                "url": get("short_link_v2") or (f"https://b23.tv/{bvid}" if bvid else None),
 
-                "tid": item.get("tid"),
-                "tname": item.get("tname"),
+                "tid": get("tid"),
+                "tname": get("tname"),
                 "pubdate": pubdate,
                 "first_seen_ts": capture_ts,
 
                 "up": {
-                    "mid": owner.get("mid"),
-                    "name": owner.get("name"),
-                    "follower": owner.get("follower"),
+                    "mid": owner_get("mid"),
+                    "name": owner_get("name"),
+                    "follower": owner_get("follower"),
                 },
 
-                "snapshots": {
-                    "as_of_capture": {
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                    "0h": {  # 兼容旧字段名（不要当“发布后0小时”理解）
-                        "ts": capture_ts,
-                        "view": stat.get("view"),
-                        "like": stat.get("like"),
-                        "coin": stat.get("coin"),
-                        "favorite": stat.get("favorite"),
-                        "reply": stat.get("reply"),
-                        "danmaku": stat.get("danmaku"),
-                        "share": stat.get("share"),
-                    },
-                },
+                # 快照（抓取这一刻）；0h 为兼容旧字段名（不要再把它理解成“发布后0小时”），
+                # 与 as_of_capture 有意共享同一个 dict（两个键的内容总是相同，不会单独修改）
+                "snapshots": {"as_of_capture": snap, "0h": snap},
                 "features": {
                     "as_of_capture": features_as_of_capture,
                     "0h": features_as_of_capture,
@@ -183,18 +210,35 @@ def normalize_popular_items(items: List[Dict[str, Any]], capture_ts: int) -> Lis
 
 
 # ================== 统计（与你旧脚本一致） ==================
+class _CatAgg:
+    """单个 tid 的分区统计中间量（slots 属性，比每次按 key 读写 dict 更省）"""
+    __slots__ = ("tname", "video_count", "view_sum", "view_cnt", "like_rate_sum", "like_rate_cnt")
+
+    def __init__(self, tname: Any) -> None:
+        self.tname = tname
+        self.video_count = 0
+        self.view_sum = 0
+        self.view_cnt = 0
+        self.like_rate_sum = 0.0
+        self.like_rate_cnt = 0
+
+
 def recompute_run_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
     videos = doc.get("videos", []) or []
 
     doc["count"] = len(videos)
 
-    doc.setdefault("meta", {})
-    doc["meta"]["pos_count"] = len([v for v in videos if v.get("label") == 1])
-    doc["meta"]["neg_count"] = len([v for v in videos if v.get("label") == 0])
-    doc["meta"]["total_count"] = len(videos)
-
-    cat: Dict[str, Dict[str, Any]] = {}
+    # 单次遍历：pos/neg 计数与分区统计一起做
+    pos = 0
+    neg = 0
+    cat: Dict[str, _CatAgg] = {}
     for v in videos:
+        label = v.get("label")
+        if label == 1:
+            pos += 1
+        elif label == 0:
+            neg += 1
+
         tid = v.get("tid")
         if tid is None:
             continue
@@ -209,34 +253,34 @@ def recompute_run_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
         feat = feats.get("as_of_capture") or feats.get("0h") or {}
         like_rate_as_of = feat.get("like_rate")
 
-        if tid not in cat:
-            cat[tid] = {
-                "tname": tname,
-                "video_count": 0,
-                "view_sum": 0,
-                "view_cnt": 0,
-                "like_rate_sum": 0.0,
-                "like_rate_cnt": 0,
-            }
+        entry = cat.get(tid)
+        if entry is None:
+            entry = cat[tid] = _CatAgg(tname)
 
-        cat[tid]["video_count"] += 1
+        entry.video_count += 1
 
         if isinstance(view_as_of, (int, float)):
-            cat[tid]["view_sum"] += view_as_of
-            cat[tid]["view_cnt"] += 1
+            entry.view_sum += view_as_of
+            entry.view_cnt += 1
 
         if isinstance(like_rate_as_of, (int, float)):
-            cat[tid]["like_rate_sum"] += like_rate_as_of
-            cat[tid]["like_rate_cnt"] += 1
-
-    out: Dict[str, Dict[str, Any]] = {}
-    for tid, s in cat.items():
-        out[tid] = {
-            "tname": s["tname"],
-            "video_count": s["video_count"],
-            "avg_view_0h": (s["view_sum"] / s["view_cnt"]) if s["view_cnt"] > 0 else None,
-            "avg_like_rate_0h": (s["like_rate_sum"] / s["like_rate_cnt"]) if s["like_rate_cnt"] > 0 else None,
+            entry.like_rate_sum += like_rate_as_of
+            entry.like_rate_cnt += 1
+
+    doc.setdefault("meta", {})
+    doc["meta"]["pos_count"] = pos
+    doc["meta"]["neg_count"] = neg
+    doc["meta"]["total_count"] = len(videos)
+
+    out: Dict[str, Dict[str, Any]] = {
+        tid: {
+            "tname": e.tname,
+            "video_count": e.video_count,
+            "avg_view_0h": (e.view_sum / e.view_cnt) if e.view_cnt > 0 else None,
+            "avg_like_rate_0h": (e.like_rate_sum / e.like_rate_cnt) if e.like_rate_cnt > 0 else None,
         }
+        for tid, e in cat.items()
+    }
 
     doc["category_stats"] = out
     return doc
@@ -262,17 +306,12 @@ def _unique_capture_key(capture_ts: int, run_id: str, existing_captures: Dict[st
         i += 1
 
 
-def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH) -> Dict[str, Any]:
-    """
-    把本次 run_doc 的 videos 合并进聚合总文件：
-    - 按 bvid 聚合
-    - 每条抓取记录追加到 videos[bvid].captures[<timestamp_key>] 下
-    """
-    agg = load_json_if_exists(agg_path) or {
+def _new_agg_index(created_ts: Any) -> Dict[str, Any]:
+    return {
         "source": "bilibili_popular",
-        "created_ts": run_doc.get("capture_ts"),
-        "last_update_ts": run_doc.get("capture_ts"),
-        # 用 dict 方便查找：videos_by_bvid[bvid] = {...}
+        "created_ts": created_ts,
+        "last_update_ts": created_ts,
+        # 用 dict 方便查找：videos_by_bvid[bvid] = {...}（不含 captures）
         "videos_by_bvid": {},
         "meta": {
             "video_unique_count": 0,
@@ -280,12 +319,130 @@ def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH)
         },
     }
 
-    agg["last_update_ts"] = run_doc.get("capture_ts")
-    videos_by_bvid: Dict[str, Any] = agg.get("videos_by_bvid") or {}
+
+def append_captures(path: str, rows: List[Dict[str, Any]], nodes: Dict[str, Any]) -> int:
+    """
+    追加写入 captures NDJSON：整批序列化后一次 write，fsync 后才返回（调用方随后再写 index）
+    每行记下同一 bvid 上一条 capture 的字节偏移（prev），index node 记最新一条（last_offset），
+    按 bvid 读历史时 mmap + 沿链表跳读即可，不用扫整份文件
+    返回追加后的文件大小
+    """
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    if not rows:
+        return offset
+    chunks: List[bytes] = []
+    for r in rows:
+        node = nodes[r["bvid"]]
+        r["prev"] = node.get("last_offset")
+        line = orjson.dumps(r, option=_OPT_NDJSON)
+        node["last_offset"] = offset
+        offset += len(line)
+        chunks.append(line)
+    with open(path, "ab") as f:
+        f.write(b"".join(chunks))
+        f.flush()
+        os.fsync(f.fileno())
+    return offset
+
+
+def _recover_trailing_captures(index: Dict[str, Any], captures_path: str) -> None:
+    """
+    NDJSON 已追加、index 还没写完就崩溃时，文件尾部会有 index 不知道的行：
+    按 captures_size 找到这些行补进 index（prev 写入时已按旧 index 计算，正好接在链上）；
+    写了一半、没有换行的最后一行截掉。旧 index 没有 captures_size 时不做检查
+    """
+    covered = index.get("captures_size")
+    if not isinstance(covered, int) or not os.path.exists(captures_path):
+        return
+    size = os.path.getsize(captures_path)
+    if size <= covered:
+        return
+
+    nodes: Dict[str, Any] = index.setdefault("videos_by_bvid", {})
+    offset = covered
+    recovered = 0
+    with open(captures_path, "rb") as f:
+        f.seek(covered)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                cap = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                break
+            bvid = cap.get("bvid")
+            if bvid:
+                # 本次 run 若再抓到该 bvid，固定字段会在 update_aggregate_history 里补齐
+                node = nodes.setdefault(bvid, {"bvid": bvid, "latest_capture_ts": None, "captures_count": 0})
+                ts = cap.get("ts")
+                latest = node.get("latest_capture_ts")
+                if isinstance(ts, int):
+                    node["latest_capture_ts"] = ts if latest is None else max(latest, ts)
+                node["captures_count"] = node.get("captures_count", 0) + 1
+                node["last_offset"] = offset
+                recovered += 1
+            offset += len(line)
+
+    if offset < size:
+        with open(captures_path, "r+b") as f:
+            f.truncate(offset)
+    index["captures_size"] = offset
+    meta = index.setdefault("meta", {})
+    meta["video_unique_count"] = len(nodes)
+    meta["capture_record_count"] = meta.get("capture_record_count", 0) + recovered
+
+
+def _migrate_legacy_aggregate(index_path: str, captures_path: str) -> Optional[Dict[str, Any]]:
+    """
+    旧版 popular_history.json → captures NDJSON + index（只在 index 尚不存在时执行一次）
+    captures 按原有 key 顺序写出，load_aggregate_history 重建时得到相同的 key
+    """
+    legacy = load_json_if_exists(AGG_PATH)
+    if not legacy:
+        return None
+
+    index = _new_agg_index(legacy.get("created_ts"))
+    index["last_update_ts"] = legacy.get("last_update_ts")
+    nodes = index["videos_by_bvid"]
+    rows: List[Dict[str, Any]] = []
+    for bvid, node in (legacy.get("videos_by_bvid") or {}).items():
+        meta_node = {k: v for k, v in node.items() if k != "captures"}
+        captures = node.get("captures") or {}
+        meta_node["latest_capture_ts"] = max((c.get("ts") for c in captures.values() if c.get("ts") is not None), default=None)
+        meta_node["captures_count"] = len(captures)
+        nodes[bvid] = meta_node
+        for cap in captures.values():
+            rows.append({"bvid": bvid, **cap})
+
+    index["meta"]["video_unique_count"] = len(nodes)
+    index["meta"]["capture_record_count"] = (legacy.get("meta") or {}).get("capture_record_count", len(rows))
+    index["captures_size"] = append_captures(captures_path, rows, nodes)
+    atomic_write_json(index_path, index)
+    return index
+
+
+def update_aggregate_history(
+    run_doc: Dict[str, Any],
+    index_path: str = AGG_INDEX_PATH,
+    captures_path: str = AGG_CAPTURES_PATH,
+) -> Dict[str, Any]:
+    """
+    把本次 run_doc 的 videos 合并进聚合：
+    - 按 bvid 聚合，index 只更新固定字段与 latest_capture_ts / captures_count
+    - 每条抓取记录追加一行到 NDJSON（写入量只与本次 run 相关，不再随历史增长）
+    """
+    index = load_json_if_exists(index_path) or _migrate_legacy_aggregate(index_path, captures_path) \
+        or _new_agg_index(run_doc.get("capture_ts"))
+
+    _recover_trailing_captures(index, captures_path)
+
+    index["last_update_ts"] = run_doc.get("capture_ts")
+    videos_by_bvid: Dict[str, Any] = index.get("videos_by_bvid") or {}
     run_id = run_doc.get("run_id") or "unknown_run"
     capture_ts = run_doc.get("capture_ts")
 
     added_records = 0
+    rows: List[Dict[str, Any]] = []
     for v in run_doc.get("videos", []) or []:
         bvid = v.get("bvid")
         if not bvid:
@@ -305,8 +462,8 @@ def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH)
                 "pubdate": v.get("pubdate"),
                 "up": v.get("up"),
                 "first_seen_ts": v.get("first_seen_ts"),
-                # ✅ 核心：不同时间戳下的数据都放在这里
-                "captures": {},  # key: capture_ts 或带 run_id 的唯一 key
+                "latest_capture_ts": None,
+                "captures_count": 0,
             }
 
         # 固定字段：以“最新一次”覆盖（你也可以改成只在 None 时写）
@@ -321,26 +478,122 @@ def update_aggregate_history(run_doc: Dict[str, Any], agg_path: str = AGG_PATH)
         elif node.get("first_seen_ts") is None and isinstance(v.get("first_seen_ts"), int):
             node["first_seen_ts"] = v["first_seen_ts"]
 
-        captures: Dict[str, Any] = node.get("captures") or {}
-        key = _unique_capture_key(int(v.get("capture_ts") or capture_ts), str(run_id), captures)
-
-        # 只把“会变化的东西”放到 captures 里（你要求的“放在每一个视频下面”）
-        captures[key] = {
-            "ts": int(v.get("capture_ts") or capture_ts),
+        # capture key 不在这里分配：读取时按追加顺序用 _unique_capture_key 重建，与旧版一致
+        ts = int(v.get("capture_ts") or capture_ts)
+        rows.append({
+            "bvid": bvid,
+            "ts": ts,
             "run_id": run_id,
             "snapshots": v.get("snapshots"),
             "features": v.get("features"),
-        }
+        })
 
-        node["captures"] = captures
+        latest = node.get("latest_capture_ts")
+        node["latest_capture_ts"] = ts if latest is None else max(latest, ts)
+        node["captures_count"] = node.get("captures_count", 0) + 1
         videos_by_bvid[bvid] = node
         added_records += 1
 
-    agg["videos_by_bvid"] = videos_by_bvid
-    agg["meta"]["video_unique_count"] = len(videos_by_bvid)
-    agg["meta"]["capture_record_count"] = agg["meta"].get("capture_record_count", 0) + added_records
+    # NDJSON fsync 之后才写 index：index 引用的偏移一定已落盘
+    index["captures_size"] = append_captures(captures_path, rows, videos_by_bvid)
+
+    index["videos_by_bvid"] = videos_by_bvid
+    index["meta"]["video_unique_count"] = len(videos_by_bvid)
+    index["meta"]["capture_record_count"] = index["meta"].get("capture_record_count", 0) + added_records
+
+    atomic_write_json(index_path, index)
+    return index
+
 
-    save_json(agg_path, agg)
+def iter_captures(captures_path: str = AGG_CAPTURES_PATH, end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    逐行流式读取 captures NDJSON（每行带 bvid），不把整份历史读进内存
+    end 为 index 的 captures_size 时只读 index 已知的部分（崩溃后尚未补进 index 的尾部行不读）
+    """
+    if not os.path.exists(captures_path):
+        return
+    pos = 0
+    with open(captures_path, "rb") as f:
+        for line in f:
+            if end is not None and pos >= end:
+                return
+            pos += len(line)
+            if not line.strip():
+                continue
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # 崩溃留下的半行（下次 update_aggregate_history 会截掉）
+                continue
+
+
+def load_video_captures(
+    bvid: str,
+    index: Optional[Dict[str, Any]] = None,
+    index_path: str = AGG_INDEX_PATH,
+    captures_path: str = AGG_CAPTURES_PATH,
+) -> List[Dict[str, Any]]:
+    """
+    只读一个 bvid 的全部 capture（按追加顺序）：从 index 的 last_offset 出发，
+    在 mmap 上沿 prev 偏移逐条跳读，内存与耗时只和该 bvid 的 capture 数有关
+    早于偏移链写入的旧行不在链上：链上条数少于 captures_count 时退回全量扫描该 bvid
+    """
+    if index is None:
+        index = load_json_if_exists(index_path) or _new_agg_index(None)
+    node = (index.get("videos_by_bvid") or {}).get(bvid) or {}
+    if not os.path.exists(captures_path) or os.path.getsize(captures_path) == 0:
+        return []
+
+    out: List[Dict[str, Any]] = []
+    offset = node.get("last_offset")
+    if offset is not None:
+        with open(captures_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while offset is not None:
+                end = mm.find(b"\n", offset)
+                cap = orjson.loads(mm[offset:end if end != -1 else len(mm)])
+                offset = cap.pop("prev", None)
+                cap.pop("bvid", None)
+                out.append(cap)
+        out.reverse()
+
+    if len(out) >= int(node.get("captures_count") or 0):
+        return out
+
+    # 链不完整（有偏移链之前写入的旧行）：按追加顺序全量扫一遍，只保留该 bvid
+    out = []
+    for cap in iter_captures(captures_path, index.get("captures_size")):
+        if cap.pop("bvid", None) == bvid:
+            cap.pop("prev", None)
+            out.append(cap)
+    return out
+
+
+def load_aggregate_history(
+    index_path: str = AGG_INDEX_PATH,
+    captures_path: str = AGG_CAPTURES_PATH,
+) -> Dict[str, Any]:
+    """
+    还原旧版 popular_history.json 的结构（videos_by_bvid[bvid]["captures"][key]）
+    capture key 按追加顺序用 _unique_capture_key 分配
+    """
+    agg = load_json_if_exists(index_path) or _new_agg_index(None)
+    videos_by_bvid: Dict[str, Any] = agg.get("videos_by_bvid") or {}
+    for node in videos_by_bvid.values():
+        node.pop("latest_capture_ts", None)
+        node.pop("captures_count", None)
+        node.pop("last_offset", None)
+        node["captures"] = {}
+
+    for cap in iter_captures(captures_path, agg.pop("captures_size", None)):
+        node = videos_by_bvid.get(cap.pop("bvid", None))
+        cap.pop("prev", None)
+        if node is None:
+            continue
+        captures = node["captures"]
+        key = _unique_capture_key(int(cap.get("ts")), str(cap.get("run_id")), captures)
+        captures[key] = cap
+
+    agg["videos_by_bvid"] = videos_by_bvid
     return agg
 
 
@@ -372,20 +625,30 @@ def main(pn_max: int = PN_MAX, ps: int = PS) -> None:
 
     s = build_session()
     try:
-        for pn in range(1, pn_max + 1):
-            raw = fetch_popular_page(s, pn=pn, ps=ps)
-            items = raw.get("data", {}).get("list", [])
-
-            if not items:
-                print(f"[INFO] pn={pn} returned empty list, stop pagination.")
-                break
-
-            raw_path = os.path.join(RAW_DIR, f"{date}__run_{run_id}__pn{pn}__ps{ps}.json")
-            save_json(raw_path, raw)
-
-            all_items.extend(items)
-            pages_fetched += 1
-            time.sleep(SLEEP_BETWEEN_PAGES)
+        with ThreadPoolExecutor(max_workers=PAGE_WINDOW) as pool:
+            stop = False
+            for start in range(1, pn_max + 1, PAGE_WINDOW):
+                pns = range(start, min(start + PAGE_WINDOW, pn_max + 1))
+                raws = pool.map(lambda pn: fetch_popular_page(s, pn=pn, ps=ps), pns)
+
+                # 按 pn 顺序处理，保证与串行版本结果一致
+                for pn, (raw, raw_bytes) in zip(pns, raws):
+                    items = raw.get("data", {}).get("list", [])
+
+                    if not items:
+                        print(f"[INFO] pn={pn} returned empty list, stop pagination.")
+                        stop = True
+                        break
+
+                    raw_path = os.path.join(RAW_DIR, f"{date}__run_{run_id}__pn{pn}__ps{ps}.json")
+                    write_bytes(raw_path, raw_bytes)
+
+                    all_items.extend(items)
+                    pages_fetched += 1
+
+                if stop:
+                    break
+                time.sleep(SLEEP_BETWEEN_PAGES)
     finally:
         s.close()
 
@@ -394,16 +657,16 @@ def main(pn_max: int = PN_MAX, ps: int = PS) -> None:
     doc["videos"] = videos
     doc = recompute_run_fields(doc)
 
-    save_json(run_path, doc)
+    atomic_write_json(run_path, doc, pretty=True)
 
     # ✅ 增量更新聚合总文件：把本次 run 的数据挂到每个 bvid 的 captures 下
-    agg = update_aggregate_history(doc, AGG_PATH)
+    agg = update_aggregate_history(doc)
 
     print(
         f"[OK] date={date} run_id={run_id} pages={pages_fetched} "
         f"items={len(all_items)} videos={len(videos)} -> {run_path}"
     )
-    print(f"[OK] agg -> {AGG_PATH} (unique_videos={agg['meta']['video_unique_count']})")
+    print(f"[OK] agg -> {AGG_CAPTURES_PATH} + {AGG_INDEX_PATH} (unique_videos={agg['meta']['video_unique_count']})")
 
 
 if __name__ == "__main__":
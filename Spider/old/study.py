@@ -1,23 +1,28 @@
 # -*- coding: utf-8 -*-
 import requests
-from bs4 import BeautifulSoup
 
 url = "https://www.baidu.com"
 
 
+def main() -> None:
+    # bs4/lxml 只在直接运行时才导入，import study 不会发请求也不会初始化解析器
+    from bs4 import BeautifulSoup
 
+    # 1. 发请求
+    response = requests.get(url)
+    response.encoding = "utf-8"   # 或 gbk / gb2312
+    print(response.text)
+    # 2. 看返回内容
+    html = response.text
 
-# 1. 发请求
-response = requests.get(url)
-response.encoding = "utf-8"   # 或 gbk / gb2312
-print(response.text)
-# 2. 看返回内容
-html = response.text
+    # 3. 解析 HTML
+    soup = BeautifulSoup(html, "lxml")
 
-# 3. 解析 HTML
-soup = BeautifulSoup(html, "lxml")
+    # 4. 抓标题
+    title = soup.title.text
 
-# 4. 抓标题
-title = soup.title.text
+    print(title)
 
-print(title)
\ No newline at end of file
+
+if __name__ == "__main__":
+    main()
@@ -13,91 +13,58 @@ update_snapshots.py — Week2: 快照补抓（宽松版，按捕捉次数）
    超过4次 -> 跳过
 ✅ 不覆盖已有快照
 ✅ 更稳健：connect/read 超时、异常吞掉继续跑
+✅ 线程池并发拉取 stat，限速由 RateLimiter 统一控制（默认 --sleep 0.2，全部线程合计约 5 次/秒）；合并/写盘仍在主线程
+✅ 运行中每 CHECKPOINT_EVERY 个更新追加到 data/daily/YYYY-MM-DD.jsonl（journal）作 checkpoint；
+   运行结束回放后整份原子写回 json（fsync）并删除 journal
 """
 
 from __future__ import annotations
 
 import argparse
-import json
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import orjson
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from zoneinfo import ZoneInfo  # Python 3.9+
 
+from common.daily import (
+    append_journal,
+    journal_path,
+    like_rate,
+    load_daily,
+    recompute_daily_stats,
+    save_daily,
+    utc_ts,
+)
+from common.http import RateLimiter, paced_get, request_session
+
 STAT_API = "https://api.bilibili.com/x/web-interface/wbi/view"
 
-DATA_DIR = "data"
-DAILY_DIR = os.path.join(DATA_DIR, "daily")
+SLOTS = ["1h", "3h", "6h", "12h"]
 
-HEADERS = {
-    "User-Agent": (
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36"
-    ),
-    "Accept": "application/json, text/plain, */*",
-    "Referer": "https://www.bilibili.com/",
-}
+# 北京时间：模块级构造一次，now_beijing() 不再每次重新查 tz 数据
+BJ_TZ = ZoneInfo("Asia/Shanghai")
 
-SLOTS = ["1h", "3h", "6h", "12h"]
+# 并发拉取 stat 的线程数
+MAX_WORKERS = 32
+# 请求间隔基准（秒）：RateLimiter 由全部线程共享，0.2 即整体约 5 次/秒，与原先串行 sleep 0.2 的速率一致；
+# 并发只用来重叠网络等待，不提高请求速率。设为 0 则不限速（仅在 429/412 时退避）
+DEFAULT_SLEEP = 0.20
+# 每更新 N 个视频向 journal 追加一批 put，崩溃时最多丢这么多
+CHECKPOINT_EVERY = 200
 
 
 def now_beijing() -> datetime:
-    return datetime.now(ZoneInfo("Asia/Shanghai"))
+    return datetime.now(BJ_TZ)
 
 
 def today_str_beijing() -> str:
     return now_beijing().date().isoformat()
 
 
-def utc_ts() -> int:
-    return int(time.time())
-
-
-def ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
-
-
-def read_json(path: str) -> Any:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def atomic_write_json(path: str, obj: Any) -> None:
-    ensure_dir(os.path.dirname(path))
-    tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, path)
-
-
-def request_session() -> requests.Session:
-    s = requests.Session()
-    s.headers.update(HEADERS)
-
-    retry = Retry(
-        total=3,
-        backoff_factor=0.8,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"],
-        raise_on_status=False,
-    )
-    adapter = HTTPAdapter(max_retries=retry, pool_connections=50, pool_maxsize=50)
-    s.mount("https://", adapter)
-    s.mount("http://", adapter)
-    return s
-
-
-def like_rate(like: int, view: int) -> Optional[float]:
-    if view <= 0:
-        return None
-    return round(float(like) / float(view), 6)
-
-
 def next_slot(snapshots: Dict[str, Any]) -> Optional[str]:
     """根据已有快照数量，找到下一个未写入的槽位"""
     if not isinstance(snapshots, dict):
@@ -108,13 +75,13 @@ def next_slot(snapshots: Dict[str, Any]) -> Optional[str]:
     return None
 
 
-def get_stat_by_bvid(s: requests.Session, bvid: str) -> Optional[Dict[str, Any]]:
+def get_stat_by_bvid(s: requests.Session, limiter: RateLimiter, bvid: str) -> Optional[Dict[str, Any]]:
     """
-    仅 bvid 调用 archive/stat
+    仅 bvid 调用 archive/stat（在线程池中执行）
     更稳健：timeout 用 (connect, read)，避免长时间卡住
     """
     try:
-        r = s.get(STAT_API, params={"bvid": bvid}, timeout=(5, 12))
+        r = paced_get(s, limiter, STAT_API, params={"bvid": bvid}, timeout=(5, 12))
     except (requests.Timeout, requests.RequestException):
         return None
 
@@ -122,7 +89,7 @@ def get_stat_by_bvid(s: requests.Session, bvid: str) -> Optional[Dict[str, Any]]
         return None
 
     try:
-        payload = r.json()
+        payload = orjson.loads(r.content)
     except Exception:
         return None
 
@@ -136,54 +103,68 @@ def get_stat_by_bvid(s: requests.Session, bvid: str) -> Optional[Dict[str, Any]]
     return data
 
 
-def recompute_daily_stats(daily: Dict[str, Any]) -> None:
-    videos = daily.get("videos", [])
-    daily["count"] = len(videos)
+def write_snapshot(v: Dict[str, Any], slot: str, stat: Dict[str, Any]) -> None:
+    """把一次 stat 结果写进 v 的 slot 槽位（snapshots/features 已在预扫描中规范为 dict）"""
+    # 每个视频只取一次时间
+    now_ts = utc_ts()
 
-    pos = sum(1 for v in videos if int(v.get("label", 0)) == 1)
-    neg = sum(1 for v in videos if int(v.get("label", 0)) == 0)
-    daily["meta"] = {"pos_count": pos, "neg_count": neg, "total_count": len(videos)}
+    # wbi/view 的统计字段在 data.stat 里
+    stat_obj = stat.get("stat") or {}
+    if not isinstance(stat_obj, dict):
+        stat_obj = {}
 
-    cat: Dict[str, Any] = {}
-    for v in videos:
-        tid = v.get("tid")
-        if tid is None:
-            continue
-        tid_s = str(tid)
-        tname = v.get("tname") or ""
-        if tid_s not in cat:
-            cat[tid_s] = {"tname": tname, "video_count": 0}
-        if not cat[tid_s]["tname"] and tname:
-            cat[tid_s]["tname"] = tname
-        cat[tid_s]["video_count"] += 1
-    daily["category_stats"] = cat
+    view = int(stat_obj.get("view") or 0)
+    like = int(stat_obj.get("like") or 0)
+    coin = int(stat_obj.get("coin") or 0)
+
+    # 每次运行只写一个槽位（第1次/第2次/第3次/第4次）
+    v["snapshots"][slot] = {
+        "ts": now_ts,
+        "view": view,
+        "like": like,
+        "coin": coin,
+    }
+    v["features"][slot] = {
+        "like_rate": like_rate(like, view),
+    }
+
+
+def stats_key(daily: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    """用于判断重算后的汇总是否与已落盘的一致"""
+    return daily.get("count"), daily.get("meta"), daily.get("category_stats")
 
 
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("day", nargs="?", default=today_str_beijing(), help="YYYY-MM-DD (default: Beijing today)")
-    ap.add_argument("--sleep", type=float, default=0.20, help="sleep seconds per request (default: 0.20)")
+    ap.add_argument(
+        "--sleep",
+        type=float,
+        default=DEFAULT_SLEEP,
+        help=f"base seconds between requests, shared by all workers; backs off on 429/412 (default: {DEFAULT_SLEEP})",
+    )
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS, help=f"concurrent stat requests (default: {MAX_WORKERS})")
+    # 每次运行结束都会整份写回 json；保留该参数只为兼容已有的定时任务命令行
+    ap.add_argument("--compact", action="store_true", help="no-op: every run folds the day journal into the json")
     ap.add_argument("--log_every", type=int, default=50, help="print progress every N videos (default: 50)")
     args = ap.parse_args()
 
     day = args.day
-    daily_path = os.path.join(DAILY_DIR, f"{day}.json")
-    if not os.path.exists(daily_path):
-        raise FileNotFoundError(f"daily file not found: {daily_path}")
-
-    daily = read_json(daily_path)
-    videos: List[Dict[str, Any]] = daily.get("videos", [])
-
-    s = request_session()
+    jpath = journal_path(day)
+    # 采集脚本与本脚本的增量都写在 YYYY-MM-DD.jsonl：load_daily 已回放，得到最新的完整记录
+    # daily["videos"] 仍是落盘的 list（没有 bvid / bvid 重复的记录原样保留），本脚本按 list 下标处理，不需要索引
+    daily, _ = load_daily(day)
+    videos: List[Dict[str, Any]] = daily["videos"]
 
     updated = 0
     skipped_full = 0
     skipped_no_bvid = 0
     failed = 0
 
-    total = len(videos)
-
-    for i, v in enumerate(videos, 1):
+    # 预扫描：规范化 snapshots/features，挑出本次需要补抓的视频 (videos 下标, bvid, 槽位)，
+    # 跳过计数在这里一次算完；网络请求只针对 pending，进度也按 pending 计
+    pending: List[Tuple[int, str, str]] = []
+    for idx, v in enumerate(videos):
         bvid = str(v.get("bvid") or "").strip()
         if not bvid:
             skipped_no_bvid += 1
@@ -195,61 +176,69 @@ def main() -> None:
             snapshots = {}
         if not isinstance(features, dict):
             features = {}
+        v["snapshots"] = snapshots
+        v["features"] = features
 
         slot = next_slot(snapshots)
         if slot is None:
             skipped_full += 1
-            v["snapshots"] = snapshots
-            v["features"] = features
             continue
+        pending.append((idx, bvid, slot))
 
-        stat = get_stat_by_bvid(s, bvid)
-        if stat is None:
-            failed += 1
-            continue
-
-        now_ts = utc_ts()
-
-        # wbi/view 的统计字段在 data.stat 里
-        stat_obj = stat.get("stat") or {}
-        if not isinstance(stat_obj, dict):
-            stat_obj = {}
-
-        view = int(stat_obj.get("view") or 0)
-        like = int(stat_obj.get("like") or 0)
-        coin = int(stat_obj.get("coin") or 0)
-
-        # 每次运行只写一个槽位（第1次/第2次/第3次/第4次）
-        snapshots[slot] = {
-            "ts": now_ts,
-            "view": view,
-            "like": like,
-            "coin": coin,
-        }
-        features[slot] = {
-            "like_rate": like_rate(like, view),
-        }
-        updated += 1
-
-        v["snapshots"] = snapshots
-        v["features"] = features
-
-        if args.log_every > 0 and i % int(args.log_every) == 0:
-            print(f"[update_snapshots] progress {i}/{total} updated={updated} failed={failed} skipped_full={skipped_full}")
-
-        time.sleep(float(args.sleep))
+    total = len(pending)
+    print(
+        f"[update_snapshots] day={day} pending={total} skipped_full={skipped_full} "
+        f"skipped_no_bvid={skipped_no_bvid} total_videos={len(videos)}"
+    )
 
-    daily["capture_ts"] = utc_ts()
-    daily["videos"] = videos
+    # 已写入新快照、尚未追加到 journal 的记录
+    dirty: List[Tuple[int, Dict[str, Any]]] = []
+
+    limiter = RateLimiter(float(args.sleep))
+    workers = max(1, int(args.workers))
+
+    # 请求在线程池并发执行；结果按 pending 顺序在主线程合并，daily 只在主线程修改
+    with request_session(pool_maxsize=max(64, workers), paced=True) as s, ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda job: get_stat_by_bvid(s, limiter, job[1]), pending)
+
+        for done, ((idx, bvid, slot), stat) in enumerate(zip(pending, results), 1):
+            if stat is None:
+                failed += 1
+            else:
+                v = videos[idx]
+                write_snapshot(v, slot, stat)
+                updated += 1
+                dirty.append((idx, v))
+                if len(dirty) >= CHECKPOINT_EVERY:
+                    # "i" 为 list 下标：同一 bvid 有多条时回放也只替换这一条
+                    append_journal(jpath, [{"op": "put", "i": i, "video": d} for i, d in dirty], daily)
+                    dirty.clear()
+
+            if args.log_every > 0 and done % int(args.log_every) == 0:
+                print(f"[update_snapshots] progress {done}/{total} updated={updated} failed={failed}")
+
+    stats_before = stats_key(daily)
     recompute_daily_stats(daily)
+    stats_dirty = stats_key(daily) != stats_before
+
+    # 定时空跑（视频都已补满 / 全部失败）、汇总未变且没有待折叠的 journal：磁盘上的 json 已是最新，不写
+    unchanged = updated == 0 and not stats_dirty and not os.path.exists(jpath)
 
-    atomic_write_json(daily_path, daily)
+    out_path: Optional[str] = None
+    if not unchanged:
+        daily["capture_ts"] = utc_ts()
+        # 回放 + 本次更新后的完整 daily 一次性原子写回（fsync），checkpoint 用的 journal 随后删除；
+        # 尚未 checkpoint 的 dirty 记录已在 daily 里，无需再追加
+        out_path = save_daily(day, daily, fsync=True)
 
     print(
         f"[update_snapshots] day={day} updated={updated} failed={failed} "
         f"skipped_full={skipped_full} skipped_no_bvid={skipped_no_bvid} total_videos={daily['count']}"
     )
-    print(f"[update_snapshots] wrote: {daily_path}")
+    if out_path is None:
+        print("[update_snapshots] no changes, skipped write")
+    else:
+        print(f"[update_snapshots] wrote: {out_path}")
 
 
 if __name__ == "__main__":